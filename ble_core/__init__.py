@@ -0,0 +1,7 @@
+# Shared BLE helpers for the ESP32 and SPIKE scripts in this repository.
+#
+# Submodules are imported on demand (from ble_core.adv import ...) so a
+# script only pays for what it uses. Freeze the package into the firmware
+# with manifest.py, or precompile it with mpy-cross (see README.md).
+
+__version__ = "0.1.0"
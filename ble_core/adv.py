@@ -0,0 +1,454 @@
+# Advertising payload codec: building, decoding, filtering and caching.
+
+from micropython import const
+import struct
+import bluetooth
+
+from ble_core.uuids import intern
+
+# Advertising payloads are repeated packets of the following form:
+#   1 byte data length (N + 1)
+#   1 byte type (see constants below)
+#   N bytes type-specific data
+
+_ADV_TYPE_FLAGS = const(0x01)
+_ADV_TYPE_SHORT_NAME = const(0x08)
+_ADV_TYPE_NAME = const(0x09)
+_ADV_TYPE_UUID16_COMPLETE = const(0x3)
+_ADV_TYPE_UUID32_COMPLETE = const(0x5)
+_ADV_TYPE_UUID128_COMPLETE = const(0x7)
+_ADV_TYPE_UUID16_MORE = const(0x2)
+_ADV_TYPE_UUID32_MORE = const(0x4)
+_ADV_TYPE_UUID128_MORE = const(0x6)
+_ADV_TYPE_TX_POWER = const(0x0A)
+_ADV_TYPE_APPEARANCE = const(0x19)
+_ADV_TYPE_MANUFACTURER = const(0xFF)
+
+
+# Generate a payload to be passed to gap_advertise(adv_data=...).
+def advertising_payload(limited_disc=False, br_edr=False, name=None, services=None, appearance=0):
+    payload = bytearray()
+
+    def _append(adv_type, value):
+        nonlocal payload
+        payload += struct.pack("BB", len(value) + 1, adv_type) + value
+
+    _append(
+        _ADV_TYPE_FLAGS,
+        struct.pack("B", (0x01 if limited_disc else 0x02) + (0x18 if br_edr else 0x04)),
+    )
+
+    if name:
+        _append(_ADV_TYPE_NAME, name)
+
+    if services:
+        for uuid in services:
+            b = bytes(uuid)
+            if len(b) == 2:
+                _append(_ADV_TYPE_UUID16_COMPLETE, b)
+            elif len(b) == 4:
+                _append(_ADV_TYPE_UUID32_COMPLETE, b)
+            elif len(b) == 16:
+                _append(_ADV_TYPE_UUID128_COMPLETE, b)
+
+    # See org.bluetooth.characteristic.gap.appearance.xml
+    if appearance:
+        _append(_ADV_TYPE_APPEARANCE, struct.pack("<h", appearance))
+
+    return payload
+
+
+_MAX_PAYLOAD = const(31)
+
+
+# Packs AD fields into an advertising payload plus a scan response payload.
+# Fields are placed in priority order (lowest first, then insertion order):
+# each goes into the advertising payload if it fits, otherwise into the
+# scan response. A name that fits in neither is shortened (type 0x08).
+# Flags must stay in the advertising payload.
+class AdvPayloadBuilder:
+    def __init__(self):
+        self._fields = []
+
+    def add(self, adv_type, value, priority=0):
+        self._fields.append((priority, len(self._fields), adv_type, bytes(value)))
+        return self
+
+    def build(self):
+        adv = bytearray()
+        resp = bytearray()
+        self._fields.sort(key=lambda f: (f[0], f[1]))
+        for _, _, adv_type, value in self._fields:
+            size = len(value) + 2
+            if len(adv) + size <= _MAX_PAYLOAD:
+                dest = adv
+            elif adv_type != _ADV_TYPE_FLAGS and len(resp) + size <= _MAX_PAYLOAD:
+                dest = resp
+            elif adv_type == _ADV_TYPE_NAME:
+                # Shorten it into whichever payload has more room left.
+                dest = adv if len(adv) < len(resp) else resp
+                room = _MAX_PAYLOAD - len(dest) - 2
+                if room < 1:
+                    raise ValueError("no room for name")
+                adv_type, value = _ADV_TYPE_SHORT_NAME, value[:room]
+            else:
+                raise ValueError("advertising payload too large")
+            dest.extend(struct.pack("BB", len(value) + 1, adv_type))
+            dest.extend(value)
+        return bytes(adv), bytes(resp)
+
+
+# Finished (adv_data, resp_data) pairs, keyed by the arguments that built them.
+_payloads = {}
+
+
+# Generate (adv_data, resp_data) to be passed to
+# gap_advertise(adv_data=..., resp_data=...). Service UUIDs of the same size
+# are packed into one list field; if the payloads cannot be built that way,
+# each UUID gets its own field (as an incomplete list), so they can be
+# spread over both payloads. Fields are placed in this order: flags,
+# services, appearance, manufacturer data, name. Anything that does not fit
+# in 31 bytes goes into the scan response. The results are immutable and
+# cached, so re-advertising after a disconnect costs nothing.
+# manufacturer is a (company_id, data) tuple.
+def advertising_payloads(
+    limited_disc=False, br_edr=False, name=None, services=None, appearance=0, manufacturer=None
+):
+    if isinstance(name, str):
+        name = name.encode()
+    uuids = tuple(bytes(u) for u in services) if services else ()
+    if manufacturer:
+        # A bytearray is unhashable and could change after caching.
+        manufacturer = (manufacturer[0], bytes(manufacturer[1]))
+    key = (limited_disc, br_edr, name, uuids, appearance, manufacturer)
+    result = _payloads.get(key)
+    if result is not None:
+        return result
+
+    flags = (0x01 if limited_disc else 0x02) + (0x18 if br_edr else 0x04)
+    try:
+        result = _build_payloads(flags, uuids, appearance, manufacturer, name, False)
+    except ValueError:
+        if len(uuids) < 2:
+            raise
+        result = _build_payloads(flags, uuids, appearance, manufacturer, name, True)
+    if len(_payloads) >= 8:
+        _payloads.clear()
+    _payloads[key] = result
+    return result
+
+
+def _build_payloads(flags, uuids, appearance, manufacturer, name, split):
+    builder = AdvPayloadBuilder()
+    builder.add(_ADV_TYPE_FLAGS, struct.pack("B", flags))
+    for size, adv_type, more_type in (
+        (2, _ADV_TYPE_UUID16_COMPLETE, _ADV_TYPE_UUID16_MORE),
+        (4, _ADV_TYPE_UUID32_COMPLETE, _ADV_TYPE_UUID32_MORE),
+        (16, _ADV_TYPE_UUID128_COMPLETE, _ADV_TYPE_UUID128_MORE),
+    ):
+        if split:
+            for u in uuids:
+                if len(u) == size:
+                    builder.add(more_type, u, 1)
+            continue
+        field = b"".join(u for u in uuids if len(u) == size)
+        if field:
+            builder.add(adv_type, field, 1)
+    if appearance:
+        builder.add(_ADV_TYPE_APPEARANCE, struct.pack("<h", appearance), 2)
+    if manufacturer:
+        builder.add(_ADV_TYPE_MANUFACTURER, struct.pack("<H", manufacturer[0]) + manufacturer[1], 3)
+    if name:
+        builder.add(_ADV_TYPE_NAME, name, 4)
+    return builder.build()
+
+
+def decode_field(payload, adv_type):
+    i = 0
+    result = []
+    while i + 1 < len(payload):
+        if payload[i + 1] == adv_type:
+            result.append(payload[i + 2 : i + payload[i] + 1])
+        i += 1 + payload[i]
+    return result
+
+
+# Result of a single walk over an advertising payload.
+# Everything except the integer fields is a memoryview slice into the
+# payload that was decoded, so nothing is copied. The scan IRQ owns adv_data,
+# so copy (bytes(...)) anything that needs to outlive the callback.
+class AdvData:
+    __slots__ = (
+        "flags",
+        "name",
+        "uuid16",
+        "uuid32",
+        "uuid128",
+        "manufacturer",
+        "appearance",
+        "tx_power",
+        "_name",
+        "_services",
+    )
+
+    def __init__(self):
+        self.flags = None
+        self.name = None
+        # Lists are only allocated when the payload contains such a field.
+        self.uuid16 = None
+        self.uuid32 = None
+        self.uuid128 = None
+        self.manufacturer = None
+        self.appearance = None
+        self.tx_power = None
+        # Memoised results of name_str() and services().
+        self._name = None
+        self._services = None
+
+    def name_str(self):
+        if self._name is None:
+            self._name = str(self.name, "utf-8") if self.name is not None else ""
+        return self._name
+
+    def services(self):
+        if self._services is not None:
+            return self._services
+        # Known UUIDs come back as the shared objects from ble_core.uuids.
+        services = []
+        if self.uuid16:
+            for u in self.uuid16:
+                services.append(intern(u))
+        if self.uuid32:
+            for u in self.uuid32:
+                services.append(bluetooth.UUID(struct.unpack("<I", u)[0]))
+        if self.uuid128:
+            for u in self.uuid128:
+                services.append(intern(u))
+        self._services = services
+        return services
+
+
+def _split(result, field, size):
+    # A UUID list field can hold several UUIDs back to back.
+    if result is None:
+        result = []
+    for i in range(0, len(field) - size + 1, size):
+        result.append(field[i : i + size])
+    return result
+
+
+# Walk the AD structures of a payload once and collect every field we know.
+# Zero-length or truncated structures end the walk.
+def decode_adv(payload):
+    adv = AdvData()
+    mv = memoryview(payload)
+    n = len(mv)
+    i = 0
+    while i + 1 < n:
+        length = mv[i]
+        end = i + length + 1
+        if length == 0 or end > n:
+            break
+        adv_type = mv[i + 1]
+        if adv_type == _ADV_TYPE_FLAGS:
+            if length > 1:
+                adv.flags = mv[i + 2]
+        elif adv_type == _ADV_TYPE_NAME:
+            adv.name = mv[i + 2 : end]
+        elif adv_type == _ADV_TYPE_SHORT_NAME:
+            if adv.name is None:
+                adv.name = mv[i + 2 : end]
+        elif adv_type == _ADV_TYPE_UUID16_COMPLETE or adv_type == _ADV_TYPE_UUID16_MORE:
+            adv.uuid16 = _split(adv.uuid16, mv[i + 2 : end], 2)
+        elif adv_type == _ADV_TYPE_UUID32_COMPLETE or adv_type == _ADV_TYPE_UUID32_MORE:
+            adv.uuid32 = _split(adv.uuid32, mv[i + 2 : end], 4)
+        elif adv_type == _ADV_TYPE_UUID128_COMPLETE or adv_type == _ADV_TYPE_UUID128_MORE:
+            adv.uuid128 = _split(adv.uuid128, mv[i + 2 : end], 16)
+        elif adv_type == _ADV_TYPE_MANUFACTURER:
+            if adv.manufacturer is None:
+                adv.manufacturer = []
+            adv.manufacturer.append(mv[i + 2 : end])
+        elif adv_type == _ADV_TYPE_APPEARANCE:
+            if length == 3:
+                adv.appearance = mv[i + 2] | mv[i + 3] << 8
+        elif adv_type == _ADV_TYPE_TX_POWER:
+            if length == 2:
+                p = mv[i + 2]
+                adv.tx_power = p - 256 if p > 127 else p
+        i = end
+    return adv
+
+
+_TICK_MASK = const(0x3FFFFFFF)
+
+
+# Bounded LRU cache of decoded payloads. Devices re-advertise the same bytes
+# every interval, so a hit (same address, same payload) returns the AdvData
+# decoded last time, including the UUID objects built by services().
+# Entries hold their own copy of the payload, so results stay valid after
+# the scan IRQ returns.
+class AdvCache:
+    def __init__(self, size=16):
+        self._size = size
+        # addr -> [payload, adv, last used]
+        self._entries = {}
+        # Use counter, wrapped to stay a small int; see _evict().
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+
+    def decode(self, addr, adv_data):
+        self._tick = (self._tick + 1) & _TICK_MASK
+        key = bytes(addr)
+        entry = self._entries.get(key)
+        # bytes compares against any buffer in C, without a copy of adv_data.
+        if entry is not None and len(entry[0]) == len(adv_data) and entry[0] == adv_data:
+            self.hits += 1
+            entry[2] = self._tick
+            return entry[1]
+        self.misses += 1
+        if entry is None and len(self._entries) >= self._size:
+            self._evict()
+        payload = bytes(adv_data)
+        adv = decode_adv(payload)
+        self._entries[key] = [payload, adv, self._tick]
+        return adv
+
+    # Drop the entry unused for the most decodes, counted modulo the wrap.
+    def _evict(self):
+        oldest = None
+        oldest_age = -1
+        for key, entry in self._entries.items():
+            age = (self._tick - entry[2]) & _TICK_MASK
+            if age > oldest_age:
+                oldest, oldest_age = key, age
+        del self._entries[oldest]
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Returns (hits, misses, entries) to help size the cache.
+    def stats(self):
+        return self.hits, self.misses, len(self._entries)
+
+
+_ADV_IND = const(0x00)
+_ADV_DIRECT_IND = const(0x01)
+
+
+# Returns the size of the UUIDs in a service list field, 0 for other fields.
+def _uuid_size(adv_type):
+    if adv_type == _ADV_TYPE_UUID16_COMPLETE or adv_type == _ADV_TYPE_UUID16_MORE:
+        return 2
+    if adv_type == _ADV_TYPE_UUID32_COMPLETE or adv_type == _ADV_TYPE_UUID32_MORE:
+        return 4
+    if adv_type == _ADV_TYPE_UUID128_COMPLETE or adv_type == _ADV_TYPE_UUID128_MORE:
+        return 16
+    return 0
+
+
+# Raw little-endian bytes of a UUID as it appears in a payload.
+# Accepts an int, a "180A" or "6E400001-B5A3-..." string, or a bluetooth.UUID.
+def _uuid_bytes(uuid):
+    if isinstance(uuid, str):
+        h = uuid.replace("-", "")
+        return int(h, 16).to_bytes(len(h) // 2, "little")
+    if isinstance(uuid, int):
+        return uuid.to_bytes(2 if uuid <= 0xFFFF else 4, "little")
+    return bytes(uuid)
+
+
+# Address as it is reported in scan results; accepts "FA:35:2F:6C:13:F8" strings.
+def _addr_bytes(addr):
+    if isinstance(addr, str):
+        return int(addr.replace(":", ""), 16).to_bytes(6, "big")
+    return bytes(addr)
+
+
+def _eq_at(buf, offset, pattern, n):
+    for j in range(n):
+        if buf[offset + j] != pattern[j]:
+            return False
+    return True
+
+
+# Scan filter compiled once from a declarative spec and matched against the
+# raw scan result. Every given criterion must match; within a criterion any
+# entry may match:
+#   services     -- UUIDs (int, str or bluetooth.UUID) listed in the payload
+#   names        -- complete local names (a short name matches as a prefix)
+#   manufacturer -- company identifiers of manufacturer specific data
+#   addrs        -- advertiser addresses (bytes or "AA:BB:..." strings)
+#   connectable  -- only accept ADV_IND / ADV_DIRECT_IND
+# match() only indexes into adv_data, so rejected packets allocate nothing.
+class ScanFilter:
+    def __init__(self, services=None, names=None, manufacturer=None, addrs=None, connectable=False):
+        self._services = [_uuid_bytes(u) for u in services] if services else None
+        self._names = [n.encode() if isinstance(n, str) else bytes(n) for n in names] if names else None
+        if isinstance(manufacturer, int):
+            manufacturer = (manufacturer,)
+        self._manufacturer = tuple(manufacturer) if manufacturer else None
+        self._addrs = [_addr_bytes(a) for a in addrs] if addrs else None
+        self._connectable = connectable
+
+    def match(self, addr, adv_type, adv_data):
+        if self._connectable and adv_type != _ADV_IND and adv_type != _ADV_DIRECT_IND:
+            return False
+        if self._addrs is not None:
+            for a in self._addrs:
+                if _eq_at(addr, 0, a, 6):
+                    break
+            else:
+                return False
+        need_service = self._services is not None
+        need_name = self._names is not None
+        need_manufacturer = self._manufacturer is not None
+        n = len(adv_data)
+        i = 0
+        while (need_service or need_name or need_manufacturer) and i + 1 < n:
+            length = adv_data[i]
+            end = i + length + 1
+            if length == 0 or end > n:
+                break
+            adv_type = adv_data[i + 1]
+            size = _uuid_size(adv_type)
+            if size and need_service:
+                for pattern in self._services:
+                    if len(pattern) != size:
+                        continue
+                    j = i + 2
+                    while j + size <= end:
+                        if _eq_at(adv_data, j, pattern, size):
+                            need_service = False
+                            break
+                        j += size
+                    if not need_service:
+                        break
+            elif adv_type == _ADV_TYPE_NAME and need_name:
+                for name in self._names:
+                    if len(name) == length - 1 and _eq_at(adv_data, i + 2, name, length - 1):
+                        need_name = False
+                        break
+            elif adv_type == _ADV_TYPE_SHORT_NAME and need_name:
+                for name in self._names:
+                    if len(name) >= length - 1 and _eq_at(adv_data, i + 2, name, length - 1):
+                        need_name = False
+                        break
+            elif adv_type == _ADV_TYPE_MANUFACTURER and need_manufacturer and length >= 3:
+                if adv_data[i + 2] | adv_data[i + 3] << 8 in self._manufacturer:
+                    need_manufacturer = False
+            i = end
+        return not (need_service or need_name or need_manufacturer)
+
+
+def decode_name(payload):
+    return decode_adv(payload).name_str()
+
+
+def decode_services(payload):
+    return decode_adv(payload).services()
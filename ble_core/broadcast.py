@@ -0,0 +1,179 @@
+# Connectionless telemetry: one transmitter, any number of listeners.
+#
+# A Broadcaster puts small messages into the manufacturer data of a
+# non-connectable advertisement. Listeners pick them up from their scan
+# results, so there is no connection setup and no per-receiver cost.
+# Manufacturer data layout (after length and type 0xFF):
+#   company   uint16  0xFFFF (reserved for internal use, not a real vendor)
+#   magic     uint8   0xB7
+#   version   uint8   VERSION
+#   channel   uint8   lets several streams share one transmitter
+#   seq       uint16  incremented per message, wraps
+#   data      up to MAX_DATA bytes
+# Each message is repeated at the advertising interval until the next one
+# is sent. Subscriber drops repeats and out-of-order copies by sequence
+# number.
+
+import struct
+import time
+from micropython import const
+
+from ble_core.adv import _eq_at
+
+COMPANY_ID = const(0xFFFF)
+VERSION = const(1)
+_MAGIC = const(0xB7)
+_ADV_TYPE_FLAGS = const(0x01)
+_ADV_TYPE_NAME = const(0x09)
+_ADV_TYPE_MANUFACTURER = const(0xFF)
+# Flags structure (3 bytes), then length, type and the 7 byte header.
+_DATA_OFFSET = const(3 + 2 + 7)
+MAX_DATA = const(31 - _DATA_OFFSET)
+_HEADER = b"\xff\xff\xb7"
+
+
+class Broadcaster:
+    def __init__(self, ble, channel=0, name=None, interval_us=100000):
+        self._ble = ble
+        self._ble.active(True)
+        self._channel = channel
+        self._interval_us = interval_us
+        self._seq = 0
+        self._buf = bytearray(31)
+        self._mv = memoryview(self._buf)
+        # General discoverable, BR/EDR not supported.
+        self._buf[0:3] = b"\x02\x01\x06"
+        self._buf[4] = _ADV_TYPE_MANUFACTURER
+        self._buf[5:8] = _HEADER
+        self._buf[8] = VERSION
+        self._buf[9] = channel
+        # The name is only sent on request, in the scan response.
+        self._resp = None
+        if name:
+            name = name.encode() if isinstance(name, str) else bytes(name)
+            self._resp = bytes((len(name) + 1, _ADV_TYPE_NAME)) + name
+
+    # Start advertising data (bytes, at most MAX_DATA) as the next message.
+    # Returns its sequence number.
+    def send(self, data):
+        n = len(data)
+        if n > MAX_DATA:
+            raise ValueError("broadcast data too long")
+        self._seq = (self._seq + 1) & 0xFFFF
+        struct.pack_into("<H", self._buf, 10, self._seq)
+        self._buf[3] = 1 + 7 + n
+        self._mv[_DATA_OFFSET : _DATA_OFFSET + n] = data
+        try:
+            self._ble.gap_advertise(
+                self._interval_us, adv_data=self._mv[: _DATA_OFFSET + n], resp_data=self._resp, connectable=False
+            )
+        except TypeError:
+            # Firmware without the connectable argument.
+            self._ble.gap_advertise(self._interval_us, adv_data=self._mv[: _DATA_OFFSET + n], resp_data=self._resp)
+        return self._seq
+
+    def stop(self):
+        self._ble.gap_advertise(None)
+
+
+# Locate a telemetry message in an advertising payload without copying.
+# Returns (channel, seq, offset, length) of its data, or None.
+def find_telemetry(adv_data):
+    n = len(adv_data)
+    i = 0
+    while i + 1 < n:
+        length = adv_data[i]
+        end = i + length + 1
+        if length == 0 or end > n:
+            return None
+        if adv_data[i + 1] == _ADV_TYPE_MANUFACTURER and length >= 8 and _eq_at(adv_data, i + 2, _HEADER, 3):
+            if adv_data[i + 5] != VERSION:
+                return None
+            return adv_data[i + 6], adv_data[i + 7] | adv_data[i + 8] << 8, i + 9, end - i - 9
+        i = end
+    return None
+
+
+# Decoded message as (channel, seq, data), or None.
+def decode_telemetry(adv_data):
+    found = find_telemetry(adv_data)
+    if found is None:
+        return None
+    channel, seq, offset, length = found
+    return channel, seq, bytes(adv_data[offset : offset + length])
+
+
+class Subscriber:
+    # Feed every scan IRQ's data tuple to scan_result(), as with the other
+    # scan helpers (sub.scan_result(data)); callback(addr, channel, seq,
+    # data) runs once per new message. A sequence number that is not ahead
+    # of the last one seen from that transmitter and channel is a repeat or
+    # arrived late, and is dropped. After timeout_ms of silence, any number
+    # is accepted again, so a restarted transmitter is picked up.
+    def __init__(self, callback, channels=None, timeout_ms=5000):
+        self._callback = callback
+        self._channels = channels
+        self._timeout_ms = timeout_ms
+        # addr + channel -> [seq, ticks_ms]
+        self._last = {}
+        self.received = 0
+        self.stale = 0
+
+    def scan_result(self, data):
+        addr = data[1]
+        adv_data = data[4]
+        found = find_telemetry(adv_data)
+        if found is None:
+            return False
+        channel, seq, offset, length = found
+        if self._channels is not None and channel not in self._channels:
+            return False
+        now = time.ticks_ms()
+        key = bytes(addr) + bytes((channel,))
+        last = self._last.get(key)
+        if last is not None:
+            ahead = (seq - last[0]) & 0xFFFF
+            if (ahead == 0 or ahead >= 0x8000) and time.ticks_diff(now, last[1]) < self._timeout_ms:
+                last[1] = now
+                self.stale += 1
+                return False
+            last[0] = seq
+            last[1] = now
+        else:
+            self._last[key] = [seq, now]
+        self.received += 1
+        self._callback(key[:6], channel, seq, bytes(adv_data[offset : offset + length]))
+        return True
+
+
+def demo(send=True):
+    import bluetooth
+    from ble_core import irq
+
+    ble = bluetooth.BLE()
+    if send:
+        b = Broadcaster(ble, channel=1, name="mpy-tele")
+        i = 0
+        while True:
+            b.send(struct.pack("<hh", i, -i))
+            i += 1
+            time.sleep_ms(200)
+
+    def on_message(addr, channel, seq, data):
+        print(channel, seq, struct.unpack("<hh", data))
+
+    sub = Subscriber(on_message)
+
+    def bt_irq(event, data):
+        if irq.event(event) == irq.IRQ_SCAN_RESULT:
+            sub.scan_result(data)
+
+    ble.active(True)
+    ble.irq(bt_irq)
+    ble.gap_scan(0, 30000, 30000)
+    while True:
+        time.sleep_ms(1000)
+
+
+if __name__ == "__main__":
+    demo()
@@ -0,0 +1,113 @@
+# Compact binary capture of scan results and other IRQ events.
+#
+# A capture is an 8 byte header followed by fixed-width 80 byte records:
+#   header: b"BLECAP" + version (1) + record size (1)
+#   record: ticks_ms  uint32
+#           event     uint8   (ble_core.irq codes)
+#           addr_type uint8
+#           addr      6 bytes
+#           rssi      int8
+#           adv_type  uint8
+#           length    uint8   (bytes used in payload)
+#           reserved  uint8
+#           payload   64 bytes (advertising data, scan response or event data)
+# Fixed-width records let the host memory-map a capture and index it
+# directly (see tools/capture.py); nothing is formatted as text on the device.
+
+import struct
+import time
+from micropython import const
+
+from ble_core import irq
+
+MAGIC = b"BLECAP"
+VERSION = const(1)
+RECORD_SIZE = const(80)
+PAYLOAD_SIZE = const(64)
+_HEADER_SIZE = const(16)
+
+
+class CaptureWriter:
+    # Records are packed into a preallocated buffer and written to the stream
+    # (a file opened "ab", or sys.stdout.buffer for USB serial) one chunk at a
+    # time. BLE IRQ handlers run in scheduler context, so a full chunk is
+    # written straight from record().
+    def __init__(self, stream, records_per_chunk=16, header=True):
+        self._stream = stream
+        self._buf = bytearray(records_per_chunk * RECORD_SIZE)
+        self._mv = memoryview(self._buf)
+        self._used = 0
+        self.count = 0
+        self.truncated = 0
+        if header:
+            stream.write(MAGIC + bytes((VERSION, RECORD_SIZE)))
+
+    def record(self, event, addr_type=0, addr=b"\0\0\0\0\0\0", rssi=0, adv_type=0, payload=b""):
+        o = self._used
+        n = len(payload)
+        if n > PAYLOAD_SIZE:
+            n = PAYLOAD_SIZE
+            payload = payload[:n]
+            self.truncated += 1
+        struct.pack_into("<IBB", self._buf, o, time.ticks_ms() & 0xFFFFFFFF, event, addr_type)
+        self._mv[o + 6 : o + 12] = addr
+        struct.pack_into("<bBBB", self._buf, o + 12, rssi, adv_type, n, 0)
+        # Bytes past length are left over from older records; readers must honour length.
+        p = o + _HEADER_SIZE
+        self._mv[p : p + n] = payload
+        self._used = o + RECORD_SIZE
+        self.count += 1
+        if self._used == len(self._buf):
+            self.flush()
+
+    # Convenience for a scan IRQ handler: capture.scan_result(data).
+    def scan_result(self, data):
+        addr_type, addr, adv_type, rssi, adv_data = data
+        self.record(irq.IRQ_SCAN_RESULT, addr_type, addr, rssi, adv_type, adv_data)
+
+    def flush(self):
+        if self._used:
+            self._stream.write(self._mv[: self._used])
+            self._used = 0
+        if hasattr(self._stream, "flush"):
+            self._stream.flush()
+
+    def close(self):
+        self.flush()
+        if hasattr(self._stream, "close"):
+            self._stream.close()
+
+
+def demo():
+    import bluetooth
+    import os
+
+    path = "scan.blecap"
+    try:
+        os.stat(path)
+        header = False
+    except OSError:
+        header = True
+    ble = bluetooth.BLE()
+    ble.active(True)
+    capture = CaptureWriter(open(path, "ab"), header=header)
+    done = False
+
+    def bt_irq(event, data):
+        nonlocal done
+        event = irq.event(event)
+        if event == irq.IRQ_SCAN_RESULT:
+            capture.scan_result(data)
+        elif event == irq.IRQ_SCAN_DONE:
+            done = True
+
+    ble.irq(bt_irq)
+    ble.gap_scan(10000, 30000, 30000)
+    while not done:
+        time.sleep_ms(100)
+    capture.close()
+    print("captured", capture.count, "records")
+
+
+if __name__ == "__main__":
+    demo()
@@ -0,0 +1,765 @@
+# Central that finds, connects to and talks to a peripheral exposing a
+# UART-style service: one characteristic we write to (rx) and one that
+# notifies us (tx). Defaults to the Nordic UART Service. Either of rx and tx
+# can be None for a peripheral without it, and more services and
+# characteristics can be discovered along, see handle().
+#
+# Optional features (active scanning, deduplication, ranking, streams and
+# fragmented messages) import their modules when first used, so a plain
+# UART central does not load them.
+
+import bluetooth
+import time
+import ubinascii
+from micropython import const
+
+from ble_core import irq, uuids
+from ble_core.adv import AdvCache, ScanFilter
+from ble_core.gattc import GattQueue, WriteStream, characteristic_ends, write_no_response
+
+UART_SERVICE_UUID = bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
+UART_RX_CHAR_UUID = bluetooth.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E")
+UART_TX_CHAR_UUID = bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E")
+
+# How long a direct connection to a remembered peer or ranked candidate may
+# take before the next one is tried.
+_DIRECT_CONNECT_MS = const(2000)
+# When poll() gives up on a direct connection the stack never reported on.
+_DIRECT_GIVE_UP_MS = const(3000)
+_DEFAULT_MTU = const(23)
+
+
+class BLESimpleCentral:
+    def __init__(
+        self,
+        ble,
+        scan_filter=None,
+        service=UART_SERVICE_UUID,
+        rx=UART_RX_CHAR_UUID,
+        tx=UART_TX_CHAR_UUID,
+        connect_on_match=False,
+        scheduler=None,
+        peers=None,
+        role="uart",
+        active_scan=False,
+        dedup_ms=0,
+        handle_cache=None,
+        mtu=None,
+        services=(),
+        chars=(),
+    ):
+        self._ble = ble
+        self._service_uuid = service
+        self._rx_uuid = rx
+        self._tx_uuid = tx
+        # Discovery results are matched by interned ID, see ble_core/uuids.py.
+        self._service_id = uuids.register(service)
+        self._rx_id = uuids.register(rx) if rx is not None else None
+        self._tx_id = uuids.register(tx) if tx is not None else None
+        # Other services whose characteristics are discovered before the
+        # main one, and characteristic UUIDs to keep handles of, see handle().
+        self._service_ids = [uuids.register(u) for u in services]
+        for u in chars:
+            uuids.register(u)
+        # Decides which scan results are worth decoding; defaults to connectable peripherals with the service.
+        self._filter = scan_filter or ScanFilter(services=[service], connectable=True)
+        # Decoded advertisements, reused while a device repeats its payload.
+        self._adv_cache = AdvCache()
+        # Connect straight from the scan IRQ instead of waiting for SCAN_DONE and connect().
+        self._connect_on_match = connect_on_match
+        # ticks_ms of scan start, match, gap_connect and discovery done, for timing().
+        self._t_scan = self._t_found = self._t_connect = self._t_ready = None
+        # Optional ble_core.scan.ScanScheduler choosing the scan duty cycle.
+        self._scheduler = scheduler
+        # Optional ble_core.peers.PeerStore: scan() tries the peers remembered for role first.
+        self._peers = peers
+        self._role = role
+        # (addr_type, addr, name, handles) to connect to directly, in order.
+        self._candidates = []
+        self._direct = False
+        # poll() cancelled a direct connection; the stack may still report it.
+        self._cancelled = False
+        self._scan_after = True
+        # Matches collected during a ranking window, see scan(window_ms=).
+        self._ranked = None
+        self._window_ms = 0
+        # The window is over and the scan was asked to stop.
+        self._window_closed = False
+        # Iterator returned by scan(); with stream the scan keeps running and every match is queued.
+        self._results = None
+        self._stream = False
+        self._matches = 0
+        # Active scanning asks for scan responses, merged with the advertisement before filtering.
+        self._active_scan = active_scan
+        self._merger = None
+        if active_scan:
+            from ble_core.scan import ScanMerger
+
+            self._merger = ScanMerger()
+        # Repeats of the same packet within dedup_ms are dropped first thing in the IRQ.
+        self._dedup = None
+        if dedup_ms:
+            from ble_core.scan import DuplicateFilter
+
+            self._dedup = DuplicateFilter(window_ms=dedup_ms)
+        # Optional ble_core.peers.HandleCache: a reconnect uses the stored
+        # handles at once and checks them with one characteristic discovery
+        # in the background; full discovery runs only if they are wrong.
+        self._handle_cache = handle_cache
+        self._gatt_key = tuple(u for u in (service, rx, tx) if u is not None) + tuple(services)
+        # MTU asked for right after connecting, before discovery; None keeps the default 23.
+        self._want_mtu = mtu
+        # Created by the first send().
+        self._fragmenter = None
+        self._ble.active(True)
+        if mtu:
+            try:
+                self._ble.config(mtu=mtu)
+            except (ValueError, TypeError):
+                # Firmware without MTU configuration.
+                self._want_mtu = None
+        self._ble.irq(self._irq)
+
+        self._gattq = None
+        self._reset()
+
+    def _reset(self):
+        # Cached name and address from a successful scan.
+        self._name = None
+        self._addr_type = None
+        self._addr = None
+
+        # Callbacks for completion of various operations.
+        # These reset back to None after being invoked.
+        self._scan_callback = None
+        self._conn_callback = None
+        self._read_callback = None
+        self._connecting = False
+
+        # Persistent callback for when new data is notified from the device.
+        self._notify_callback = None
+        # Rebuilds fragmented messages notified on tx, see on_message().
+        self._reassembler = None
+        self._mtu = _DEFAULT_MTU
+        # Last stream(), kept so its chunk size follows the MTU.
+        self._writer = None
+
+        # Connected device.
+        self._conn_handle = None
+        self._start_handle = None
+        self._end_handle = None
+        self._tx_handle = None
+        self._rx_handle = None
+        # Handles taken from the handle cache, being checked by a discovery.
+        self._verifying = None
+        # GATT procedures on the connection, one at a time; see ble_core/gattc.py.
+        if self._gattq is not None:
+            self._gattq.clear()
+        self._gattq = None
+        # Characteristics of the service by UUID ID -> (value handle, last handle), and
+        # notification callbacks by value handle, see subscribe().
+        self._chars = {}
+        self._subscriptions = {}
+        # The main service's characteristics as raw UUID hex -> [value handle,
+        # last handle], kept in the handle cache.
+        self._main_chars = {}
+        # subscribe() calls waiting for the characteristics to be known.
+        self._waiting = []
+        # CCCD handles found so far, str(value handle) -> handle, kept in the handle cache.
+        self._cccds = {}
+        # [start, end] of the other services found, kept in the handle cache,
+        # and how many of their discoveries a cached connection waits for.
+        self._ranges = []
+        self._pending_services = 0
+        # The peer is gone: look for it at full duty cycle again.
+        if self._scheduler:
+            self._scheduler.reset()
+
+    def _irq(self, event, data):
+        event = irq.event(event)
+        if self._gattq is not None and self._gattq.irq(event, data):
+            return
+        if event == irq.IRQ_SCAN_RESULT:
+            addr_type, addr, adv_type, rssi, adv_data = data
+            if self._dedup and self._dedup.seen(addr, adv_type, adv_data):
+                return
+            if self._connecting:
+                # Results queued before the scan stopped.
+                return
+            if self._merger:
+                adv_type, adv_data = self._merger.merge(addr, adv_type, adv_data)
+            if self._window_ms:
+                self._collect(addr_type, addr, adv_type, rssi, adv_data)
+            elif self._stream:
+                if self._filter.match(addr, adv_type, adv_data):
+                    self._matches += 1
+                    self._results.put((addr_type, bytes(addr), adv_type, rssi, self._adv_cache.decode(addr, adv_data)))
+            elif self._filter.match(addr, adv_type, adv_data):
+                # Found a potential device, remember it and stop scanning.
+                self._addr_type = addr_type
+                self._addr = bytes(
+                    addr
+                )  # Note: addr buffer is owned by caller so need to copy it.
+                adv = self._adv_cache.decode(addr, adv_data)
+                self._name = adv.name_str() or "?"
+                if self._results is not None:
+                    self._results.put((addr_type, self._addr, adv_type, rssi, adv))
+                self._t_found = time.ticks_ms()
+                self._ble.gap_scan(None)
+                if self._connect_on_match:
+                    self._gap_connect()
+
+        elif event == irq.IRQ_SCAN_DONE:
+            if self._results is not None:
+                self._results.finish()
+            if self._stream:
+                self._stream = False
+                if self._scheduler:
+                    self._scheduler.scan_done(self._matches > 0)
+                if self._scan_callback:
+                    self._scan_callback(None, None, None)
+                    self._scan_callback = None
+                return
+            if self._window_ms:
+                if self._scheduler:
+                    self._scheduler.scan_done(len(self._ranked) > 0)
+                # Connect to the collected matches, strongest first.
+                self._window_ms = 0
+                self._candidates = [
+                    (d.addr_type, d.addr, d.name() or "?", None) for d in self._ranked.best(len(self._ranked))
+                ]
+                self._scan_after = False
+                self._try_candidates()
+                return
+            if self._scheduler:
+                self._scheduler.scan_done(self._addr is not None)
+            if self._scan_callback:
+                if self._addr:
+                    # Found a device during the scan (and the scan was explicitly stopped).
+                    self._scan_callback(self._addr_type, self._addr, self._name)
+                    self._scan_callback = None
+                else:
+                    # Scan timed out.
+                    self._scan_callback(None, None, None)
+
+        elif event == irq.IRQ_PERIPHERAL_CONNECT:
+            # Connect successful.
+            conn_handle, addr_type, addr = data
+            if addr_type == self._addr_type and addr == self._addr:
+                self._conn_handle = conn_handle
+                self._gattq = GattQueue(self._ble, conn_handle)
+                if self._want_mtu and not irq.LEGACY:
+                    self._gattq.exchange_mtu(self._on_mtu)
+                if self._direct and self._scan_callback:
+                    # A remembered peer or ranked candidate answered; report it as the scan result.
+                    self._scan_callback(self._addr_type, self._addr, self._name)
+                    self._scan_callback = None
+                if self._direct and self._results is not None:
+                    self._results.finish()
+                cached = self._handle_cache.get(self._addr, self._gatt_key) if self._handle_cache else None
+                if cached and "chars" in cached:
+                    self._start_handle, self._end_handle = cached["start"], cached["end"]
+                    self._rx_handle, self._tx_handle = cached["rx"], cached["tx"]
+                    self._cccds = dict(cached.get("cccd") or {})
+                    # handle() answers for the main service's characteristics at once.
+                    self._main_chars = dict(cached["chars"])
+                    for raw, found in cached["chars"].items():
+                        uid = uuids.register(uuids.intern(ubinascii.unhexlify(raw)))
+                        self._chars[uid] = tuple(found)
+                    self._verifying = {"rx": None, "tx": None}
+                    # The other services' characteristics come from their cached
+                    # ranges; ready once those are known.
+                    self._ranges = [list(r) for r in cached.get("services") or ()]
+                    self._pending_services = len(self._ranges)
+                    for start_handle, end_handle in self._ranges:
+                        self._discover_other(start_handle, end_handle)
+                    if not self._ranges:
+                        self._ready()
+                    self._gattq.discover_characteristics(
+                        self._start_handle, self._end_handle, self._on_characteristics
+                    )
+                else:
+                    self._discover()
+
+        elif event == irq.IRQ_PERIPHERAL_DISCONNECT:
+            # Disconnect (either initiated by us or the remote end).
+            conn_handle, addr_type, addr = data
+            if conn_handle == self._conn_handle:
+                # If it was initiated by us, it'll already be reset.
+                self._reset()
+            elif self._direct and self._connecting and self._conn_handle is None:
+                # Direct connection to a remembered peer or candidate failed.
+                # NimBLE reports it with conn_handle 0xFFFF and a zeroed
+                # address, so the address is not checked.
+                if self._cancelled:
+                    # The attempt poll() already gave up on.
+                    self._cancelled = False
+                    return
+                self._connecting = False
+                self._try_candidates()
+
+        elif event == irq.IRQ_GATTC_NOTIFY or event == irq.IRQ_GATTC_INDICATE:
+            conn_handle, value_handle, notify_data = data
+            if conn_handle == self._conn_handle:
+                callback = self._subscriptions.get(value_handle)
+                if callback:
+                    callback(notify_data)
+                elif value_handle == self._tx_handle:
+                    if self._reassembler:
+                        self._reassembler.feed(notify_data)
+                    elif self._notify_callback:
+                        self._notify_callback(notify_data)
+
+        elif event == irq.IRQ_MTU_EXCHANGED:
+            # Exchange started by the peripheral.
+            conn_handle, mtu = data
+            if conn_handle == self._conn_handle:
+                self._on_mtu(0, mtu)
+
+    # Ranking window: every match goes into the table, and the scan stops
+    # window_ms after the first match, checked on each result and by poll().
+    def _collect(self, addr_type, addr, adv_type, rssi, adv_data):
+        if self._window_closed:
+            # Results queued before the scan stopped.
+            return
+        now = time.ticks_ms()
+        if self._filter.match(addr, adv_type, adv_data):
+            if not len(self._ranked):
+                self._t_found = now
+            d = self._ranked.update(addr_type, addr, adv_type, rssi, adv_data)
+            if self._results is not None:
+                self._results.put((addr_type, d.addr, adv_type, rssi, d.adv))
+        self._check_window(now)
+
+    def _check_window(self, now):
+        if self._t_found is not None and time.ticks_diff(now, self._t_found) >= self._window_ms:
+            self._window_closed = True
+            self._ble.gap_scan(None)
+
+    def _gap_connect(self, timeout_ms=None):
+        self._connecting = True
+        self._t_connect = time.ticks_ms()
+        try:
+            if timeout_ms:
+                self._ble.gap_connect(self._addr_type, self._addr, timeout_ms)
+            else:
+                self._ble.gap_connect(self._addr_type, self._addr)
+        except OSError:
+            self._connecting = False
+            return False
+        return True
+
+    # Find the service, then its rx and tx characteristics, through the GATT
+    # queue. On legacy firmware each discovery ends after a quiet period
+    # instead of a *_DONE event, see ble_core/gattc.py.
+    def _discover(self):
+        self._chars = {}
+        self._ranges = []
+        self._pending_services = 0
+        self._gattq.discover_services(self._on_services)
+
+    def _on_services(self, status, services):
+        if status != 0:
+            print("Failed to discover services, status", status)
+            return
+        main = None
+        for start_handle, end_handle, uuid in services:
+            uid = uuids.uuid_id(uuid)
+            if uid == self._service_id:
+                main = (start_handle, end_handle)
+            elif uid and uid in self._service_ids:
+                # Queued first, so they are known when the main one completes.
+                self._ranges.append([start_handle, end_handle])
+                self._discover_other(start_handle, end_handle)
+        if main is None:
+            print("Failed to find uart service.")
+            return
+        self._start_handle, self._end_handle = main
+        self._gattq.discover_characteristics(main[0], main[1], self._on_characteristics)
+
+    def _discover_other(self, start_handle, end_handle):
+        def on_characteristics(status, characteristics):
+            if status != 0:
+                print("Failed to discover characteristics, status", status)
+            else:
+                self._record_characteristics(characteristics, end_handle)
+            if self._pending_services:
+                self._pending_services -= 1
+                if not self._pending_services:
+                    self._ready()
+
+        self._gattq.discover_characteristics(start_handle, end_handle, on_characteristics)
+
+    def _on_characteristics(self, status, characteristics):
+        if status != 0:
+            # Treated as nothing found: a cache check falls back to full discovery.
+            print("Failed to discover characteristics, status", status)
+            characteristics = ()
+        found = self._verifying
+        self._main_chars = {}
+        self._record_characteristics(characteristics, self._end_handle, True)
+        for def_handle, value_handle, properties, uuid in characteristics:
+            uid = uuids.uuid_id(uuid)
+            if found is not None:
+                if uid == self._rx_id:
+                    found["rx"] = value_handle
+                elif uid == self._tx_id:
+                    found["tx"] = value_handle
+            elif uid == self._rx_id:
+                self._rx_handle = value_handle
+            elif uid == self._tx_id:
+                self._tx_handle = value_handle
+        if found is not None:
+            self._check_cached_handles()
+        elif self._complete(self._rx_handle, self._tx_handle):
+            # We've finished connecting and discovering device, fire the connect callback.
+            if self._handle_cache:
+                self._handle_cache.put(self._addr, self._gatt_key, self._handles())
+            self._ready()
+        else:
+            print("Failed to find uart rx characteristic.")
+        if self._waiting and self._verifying is None and self.is_connected():
+            waiting = self._waiting
+            self._waiting = []
+            for start in waiting:
+                start()
+
+    def _on_mtu(self, status, mtu):
+        if status != 0:
+            return
+        self._mtu = mtu
+        if self._writer is not None:
+            from ble_core.fragment import payload_size
+
+            self._writer.chunk = payload_size(mtu)
+
+    def _record_characteristics(self, characteristics, end_handle, main=False):
+        ends = characteristic_ends(characteristics, end_handle)
+        for c in characteristics:
+            uid = uuids.uuid_id(c[3])
+            if uid:
+                self._chars[uid] = (c[1], ends[c[1]])
+                if main:
+                    self._main_chars[ubinascii.hexlify(bytes(c[3])).decode()] = [c[1], ends[c[1]]]
+
+    def _handles(self):
+        return {
+            "start": self._start_handle,
+            "end": self._end_handle,
+            "rx": self._rx_handle,
+            "tx": self._tx_handle,
+            "cccd": dict(self._cccds),
+            "chars": dict(self._main_chars),
+            "services": [list(r) for r in self._ranges],
+        }
+
+    # Compare the cached handles in use with what the background discovery
+    # found. Fix them up if the service range still holds the characteristics,
+    # otherwise start a full discovery.
+    def _check_cached_handles(self):
+        found = self._verifying
+        self._verifying = None
+        if found["rx"] == self._rx_handle and found["tx"] == self._tx_handle:
+            # Written only if another characteristic moved.
+            self._handle_cache.put(self._addr, self._gatt_key, self._handles())
+            return
+        if self._complete(found["rx"], found["tx"]):
+            self._rx_handle, self._tx_handle = found["rx"], found["tx"]
+            # The table moved, so the cached CCCDs are looked up again.
+            self._cccds = {}
+            self._handle_cache.put(self._addr, self._gatt_key, self._handles())
+            return
+        self._handle_cache.drop(self._addr, self._gatt_key)
+        self._cccds = {}
+        self._start_handle = self._end_handle = self._rx_handle = self._tx_handle = None
+        self._discover()
+
+    def _ready(self):
+        self._connecting = False
+        self._t_ready = time.ticks_ms()
+        self._direct = False
+        if self._peers:
+            self._peers.remember(self._role, self._addr_type, self._addr, self._name)
+        if self._scheduler:
+            self._scheduler.known()
+        if self._conn_callback:
+            self._conn_callback()
+            self._conn_callback = None
+
+    # Returns true if we've successfully connected and discovered characteristics.
+    def is_connected(self):
+        return (
+            self._conn_handle is not None
+            and not self._pending_services
+            and self._complete(self._rx_handle, self._tx_handle)
+        )
+
+    # Whether rx and tx handles are found, for the ones the service has.
+    def _complete(self, rx, tx):
+        return (rx is not None or self._rx_id is None) and (tx is not None or self._tx_id is None)
+
+    # Find a device matching the scan filter. With a peer store, the peers
+    # remembered for the role are connected to directly first, and the scan
+    # only runs if none of them answers. With connect_on_match, the connection
+    # is started as soon as a device is found and conn_callback fires once it
+    # is ready; callback still reports the scan result. With window_ms, matches
+    # are collected for that long after the first one and then connected to
+    # in order of smoothed RSSI, so the best link wins instead of the first
+    # packet; call poll() while waiting, so the window also ends when no more
+    # results come.
+    # Returns a ScanResults iterator of (addr_type, addr, adv_type, rssi, adv)
+    # matches. With stream, the scan is not stopped at a match and does not
+    # connect: every match is queued (at most queue_size, oldest dropped)
+    # until duration_ms is over or the iterator is closed.
+    def scan(
+        self,
+        callback=None,
+        duration_ms=10000,
+        conn_callback=None,
+        window_ms=0,
+        stream=False,
+        queue_size=16,
+    ):
+        self._addr_type = None
+        self._addr = None
+        self._scan_callback = callback
+        self._conn_callback = conn_callback
+        self._connecting = False
+        self._t_scan = time.ticks_ms()
+        self._t_found = self._t_connect = self._t_ready = None
+        self._scan_duration_ms = duration_ms
+        self._window_ms = 0 if stream else window_ms
+        self._window_closed = False
+        self._stream = stream
+        self._matches = 0
+        from ble_core.scan import ScanResults
+
+        self._results = ScanResults(queue_size, self.stop_scan)
+        if window_ms:
+            if self._ranked is None:
+                from ble_core.scan import ScanTable
+
+                self._ranked = ScanTable(size=16)
+            self._ranked.clear()
+        self._candidates = self._peers.peers(self._role) if self._peers and not stream else []
+        self._cancelled = False
+        self._scan_after = True
+        self._try_candidates()
+        return self._results
+
+    def stop_scan(self):
+        self._ble.gap_scan(None)
+
+    # Connect straight to the next candidate. When none is left, scan if the
+    # candidates were remembered peers, otherwise report that nothing was found.
+    def _try_candidates(self):
+        while self._candidates:
+            self._addr_type, self._addr, name, _ = self._candidates.pop(0)
+            self._name = name or "?"
+            self._direct = True
+            self._t_found = time.ticks_ms()
+            if self._gap_connect(_DIRECT_CONNECT_MS):
+                return
+        self._direct = False
+        self._addr_type = None
+        self._addr = None
+        self._t_found = None
+        if not self._scan_after:
+            if self._results is not None:
+                self._results.finish()
+            if self._scan_callback:
+                self._scan_callback(None, None, None)
+            return
+        if self._dedup:
+            self._dedup.clear()
+        if self._scheduler:
+            self._scheduler.scan(self._scan_duration_ms, self._active_scan)
+        elif self._active_scan:
+            self._ble.gap_scan(self._scan_duration_ms, 30000, 30000, True)
+        else:
+            self._ble.gap_scan(self._scan_duration_ms, 30000, 30000)
+
+    # Connect to the specified device (otherwise use cached address from a scan).
+    def connect(self, addr_type=None, addr=None, callback=None):
+        if self._connecting:
+            # Already started from the scan IRQ.
+            if callback:
+                self._conn_callback = callback
+            return True
+        self._addr_type = addr_type if addr_type is not None else self._addr_type
+        self._addr = addr or self._addr
+        self._conn_callback = callback
+        if self._addr_type is None or self._addr is None:
+            return False
+        self._t_ready = None
+        return self._gap_connect()
+
+    # Milliseconds spent in the last scan-to-connected sequence, as
+    # (scanning until a match, match until gap_connect, gap_connect until
+    # services and characteristics are discovered). None for a step not reached.
+    def timing(self):
+        def diff(a, b):
+            return time.ticks_diff(b, a) if a is not None and b is not None else None
+
+        return (
+            diff(self._t_scan, self._t_found),
+            diff(self._t_found, self._t_connect),
+            diff(self._t_connect, self._t_ready),
+        )
+
+    # Disconnect from current device.
+    def disconnect(self):
+        if not self._conn_handle:
+            return
+        self._ble.gap_disconnect(self._conn_handle)
+        self._reset()
+
+    # Send data over the UART, or to another characteristic's value handle
+    # (see handle()). A write with response waits in the GATT queue behind
+    # earlier procedures; callback(status, None) runs once it is acknowledged.
+    # Without a callback, a write the stack refuses raises OSError.
+    def write(self, v, response=False, callback=None, handle=None):
+        if not self.is_connected():
+            return
+        if handle is None:
+            handle = self._rx_handle
+        self._gattq.write(handle, v, response, callback)
+
+    # Sender for bulk data to rx as writes without response, paced by the
+    # controller's buffers; see ble_core.gattc.WriteStream. None when not connected.
+    def stream(self, size=1024):
+        if not self.is_connected():
+            return None
+        from ble_core.fragment import payload_size
+
+        self._writer = WriteStream(self._ble, self._conn_handle, self._rx_handle, size, payload_size(self._mtu))
+        return self._writer
+
+    # MTU of the connection: 23 until an exchange (see mtu=) raises it.
+    def mtu(self):
+        return self._mtu
+
+    # Send a message of any length (up to 64 KB) to rx, split into
+    # MTU-sized fragments (see ble_core/fragment.py) for a peer that
+    # rebuilds them. Returns False if the controller stayed busy for
+    # timeout_ms on one fragment.
+    def send(self, message, timeout_ms=1000):
+        if not self.is_connected():
+            return False
+        from ble_core.fragment import Fragmenter, payload_size
+
+        if isinstance(message, str):
+            message = message.encode()
+        if self._fragmenter is None:
+            self._fragmenter = Fragmenter()
+        # Reallocates only when the MTU changed.
+        self._fragmenter.set_payload(payload_size(self._mtu))
+        for fragment in self._fragmenter.split(message):
+            if not write_no_response(self._ble, self._conn_handle, self._rx_handle, fragment, timeout_ms):
+                return False
+        return True
+
+    # Set handler for fragmented messages notified on tx: callback(message)
+    # runs once per complete message. Replaces on_notify() for tx.
+    def on_message(self, callback, max_size=1024):
+        from ble_core.fragment import Reassembler
+
+        self._reassembler = Reassembler(callback, max_size)
+
+    # Value handle of a discovered characteristic of the service, or of the
+    # other services (its UUID must be rx, tx or in chars), None if not found.
+    def handle(self, char_uuid):
+        found = self._chars.get(uuids.register(char_uuid))
+        return found[0] if found else None
+
+    # Read a characteristic of the connected device; callback(status, value).
+    def read(self, value_handle, callback):
+        if not self.is_connected():
+            return
+        self._gattq.read(value_handle, callback)
+
+    # Have callback(data) called with every notification (or with indicate,
+    # indication) of a characteristic of the service or of the other services
+    # (its UUID must be rx, tx or in chars), once connected. The characteristic's
+    # CCCD is found by one descriptor discovery, or taken from the handle
+    # cache, and written once per connection.
+    def subscribe(self, char_uuid, callback, indicate=False):
+        if not self.is_connected():
+            return False
+        uid = uuids.register(char_uuid)
+
+        def on_subscribed(status, cccd_handle):
+            if status != 0:
+                print("Failed to subscribe, status", status)
+                return
+            key = str(self._chars[uid][0])
+            if self._cccds.get(key) != cccd_handle:
+                self._cccds[key] = cccd_handle
+                if self._handle_cache:
+                    self._handle_cache.put(self._addr, self._gatt_key, self._handles())
+
+        def start():
+            found = self._chars.get(uid)
+            if found is None:
+                print("Failed to find characteristic", char_uuid)
+                return
+            value_handle, end_handle = found
+            self._subscriptions[value_handle] = callback
+            self._gattq.subscribe(value_handle, end_handle, on_subscribed, indicate, self._cccds.get(str(value_handle)))
+
+        if self._verifying is not None:
+            # Connected from the handle cache: the check discovers them.
+            self._waiting.append(start)
+        else:
+            start()
+        return True
+
+    # Stop notifications (or indications) of a characteristic subscribe() was
+    # called for. Returns False if not connected or not subscribed.
+    def unsubscribe(self, char_uuid):
+        found = self._chars.get(uuids.register(char_uuid))
+        if not self.is_connected() or found is None:
+            return False
+        self._subscriptions.pop(found[0], None)
+        return self._gattq.unsubscribe(found[0])
+
+    # GATT queue of the connection, for other procedures (CCCD writes,
+    # descriptor discovery) that must not overlap with ours. None when not
+    # connected.
+    def gatt(self):
+        return self._gattq
+
+    # Expire GATT procedures that got no answer, and on legacy firmware
+    # finish discoveries. The queue's timer does this too where the port has
+    # one; calling it from wait loops covers ports without.
+    # Also ends a ranking window once traffic has gone quiet, and gives up on
+    # a direct connection the stack has not reported on.
+    def poll(self):
+        if self._window_ms and not self._window_closed:
+            self._check_window(time.ticks_ms())
+        if self._gattq is not None:
+            self._gattq.poll()
+        elif (
+            self._direct
+            and self._connecting
+            and time.ticks_diff(time.ticks_ms(), self._t_connect) >= _DIRECT_GIVE_UP_MS
+        ):
+            try:
+                self._ble.gap_connect(None)
+                self._cancelled = True
+            except (OSError, TypeError):
+                # Nothing to cancel, or firmware that cannot.
+                pass
+            self._connecting = False
+            self._try_candidates()
+
+    # Number of GATT procedures queued or running; polls first.
+    def pending(self):
+        if self._gattq is None:
+            return 0
+        self._gattq.poll()
+        return len(self._gattq)
+
+    # Set handler for when data is received over the UART.
+    def on_notify(self, callback):
+        self._notify_callback = callback
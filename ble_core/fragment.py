@@ -0,0 +1,139 @@
+# Messages larger than one ATT payload, split into MTU-sized fragments and
+# rebuilt on the other side.
+#
+# Each write or notification carries one fragment:
+#   header    uint8   START (0x80) | END (0x40) | sequence number (0..63)
+#   length    uint16  total message length, START fragment only
+#   data      the next part of the message
+# A single-fragment message has both flags set. The sequence number counts
+# fragments per direction and lets the receiver drop a message that lost a
+# fragment instead of gluing two messages together.
+
+import struct
+from micropython import const
+
+_START = const(0x80)
+_END = const(0x40)
+_SEQ_MASK = const(0x3F)
+
+# ATT payload of the default 23 byte MTU.
+DEFAULT_PAYLOAD = const(20)
+
+
+# Largest write or notification value for a negotiated MTU.
+def payload_size(mtu):
+    return mtu - 3
+
+
+class Fragmenter:
+    def __init__(self, payload=DEFAULT_PAYLOAD):
+        self._seq = 0
+        self._buf = None
+        self.set_payload(payload)
+
+    # Change the fragment size, e.g. after an MTU exchange.
+    def set_payload(self, payload):
+        if payload < 4:
+            raise ValueError("payload too small")
+        if self._buf is None or len(self._buf) != payload:
+            self._buf = bytearray(payload)
+            self._mv = memoryview(self._buf)
+        self.payload = payload
+
+    # Yield the fragments of data as memoryviews into one buffer, which the
+    # next fragment overwrites: send each before asking for the next (the
+    # bluetooth module copies what it sends).
+    def split(self, data):
+        n = len(data)
+        if n > 0xFFFF:
+            raise ValueError("message too long")
+        mv = memoryview(data)
+        buf = self._buf
+        i = 0
+        flags = _START
+        while True:
+            if flags:
+                struct.pack_into("<BH", buf, 0, 0, n)
+                head = 3
+            else:
+                head = 1
+            m = min(n - i, self.payload - head)
+            if i + m == n:
+                flags |= _END
+            buf[0] = flags | self._seq
+            self._seq = (self._seq + 1) & _SEQ_MASK
+            self._mv[head : head + m] = mv[i : i + m]
+            i += m
+            yield self._mv[: head + m]
+            if flags & _END:
+                return
+            flags = 0
+
+
+class Reassembler:
+    # feed() every received value; callback(message) runs with each complete
+    # message as bytes. Messages over max_size, and messages with a missing
+    # fragment, are dropped and counted in errors.
+    def __init__(self, callback, max_size=1024):
+        self._callback = callback
+        self._buf = bytearray(max_size)
+        self._mv = memoryview(self._buf)
+        self._max_size = max_size
+        # Length of the message being rebuilt, None between messages.
+        self._total = None
+        self._pos = 0
+        self._seq = 0
+        self.messages = 0
+        self.errors = 0
+
+    def feed(self, value):
+        n = len(value)
+        if n < 1:
+            return
+        header = value[0]
+        seq = header & _SEQ_MASK
+        if header & _START:
+            if self._total is not None:
+                # The previous message never got its END fragment.
+                self.errors += 1
+            if n < 3:
+                self._total = None
+                self.errors += 1
+                return
+            total = value[1] | value[2] << 8
+            if total > self._max_size:
+                self._total = None
+                self.errors += 1
+                return
+            self._total = total
+            self._pos = 0
+            data = memoryview(value)[3:]
+        else:
+            if self._total is None:
+                # Continuation of a message we are not rebuilding.
+                return
+            if seq != self._seq:
+                self._total = None
+                self.errors += 1
+                return
+            data = memoryview(value)[1:]
+        self._seq = (seq + 1) & _SEQ_MASK
+        m = len(data)
+        if self._pos + m > self._total:
+            self._total = None
+            self.errors += 1
+            return
+        self._mv[self._pos : self._pos + m] = data
+        self._pos += m
+        if header & _END:
+            total = self._total
+            self._total = None
+            if self._pos != total:
+                self.errors += 1
+                return
+            self.messages += 1
+            self._callback(bytes(self._mv[:total]))
+
+    # Forget a partly received message, e.g. on disconnect.
+    def reset(self):
+        self._total = None
@@ -0,0 +1,465 @@
+# GATT client procedures for one connection, issued one at a time.
+#
+# The stack handles one discovery, read or acknowledged write per
+# connection at a time; starting another before the previous *_DONE or
+# WRITE_DONE event fails with EBUSY. GattQueue queues the procedures and
+# starts the next one when the current one completes, so callers neither
+# sleep between operations nor guess how long one takes. Feed it every IRQ
+# with irq(); it returns True for events it consumed. A procedure that gets
+# no completion event within timeout_ms is finished with status TIMEOUT,
+# checked on each event, on each new procedure and on poll().
+#
+# Legacy firmware (see ble_core/irq.py) has no *_DONE events except for
+# writes: a read completes with its result, and a discovery once no result
+# has arrived for _LEGACY_QUIET_MS.
+#
+# While a procedure runs, a machine.Timer schedules poll() every _POLL_MS,
+# so a lost completion event still ends in TIMEOUT even when nothing else
+# calls into the queue. Without a usable timer, the main loop must call
+# poll() (BLESimpleCentral.poll()).
+#
+# Each procedure takes a callback(status, value), called once at completion:
+#   discover_*          value is the list of result tuples from the IRQ,
+#                       empty if the procedure failed
+#   read                value is the bytes read
+#   write, write_cccd   value is None
+#   exchange_mtu        value is the negotiated MTU
+# status is 0 on success, the stack's ATT error code, or TIMEOUT.
+
+import micropython
+import time
+from micropython import const
+
+try:
+    import machine
+except ImportError:
+    machine = None
+
+from ble_core import irq, uuids
+
+TIMEOUT = const(-1)
+# subscribe() status when the characteristic has no CCCD.
+NO_CCCD = const(-2)
+
+_DISCOVER_SERVICES = const(0)
+_DISCOVER_CHARACTERISTICS = const(1)
+_DISCOVER_DESCRIPTORS = const(2)
+_READ = const(3)
+_WRITE = const(4)
+_EXCHANGE_MTU = const(5)
+
+# Which IRQ delivers results, and which one completes, each procedure.
+_RESULT_EVENTS = (
+    irq.IRQ_GATTC_SERVICE_RESULT,
+    irq.IRQ_GATTC_CHARACTERISTIC_RESULT,
+    irq.IRQ_GATTC_DESCRIPTOR_RESULT,
+    irq.IRQ_GATTC_READ_RESULT,
+    None,
+    None,
+)
+_DONE_EVENTS = (
+    irq.IRQ_GATTC_SERVICE_DONE,
+    irq.IRQ_GATTC_CHARACTERISTIC_DONE,
+    irq.IRQ_GATTC_DESCRIPTOR_DONE,
+    irq.IRQ_GATTC_READ_DONE,
+    irq.IRQ_GATTC_WRITE_DONE,
+    irq.IRQ_MTU_EXCHANGED,
+)
+
+_LEGACY_QUIET_MS = const(200)
+_POLL_MS = const(100)
+
+_NOTIFY_ENABLE = b"\x01\x00"
+_INDICATE_ENABLE = b"\x02\x00"
+_CCCD_DISABLE = b"\x00\x00"
+
+
+# Last handle of each characteristic in a characteristic discovery result
+# list: the one before the next declaration, or end_handle for the last one.
+# Returns {value_handle: last_handle}.
+def characteristic_ends(characteristics, end_handle):
+    defs = sorted(c[0] for c in characteristics)
+    ends = {}
+    for c in characteristics:
+        last = end_handle
+        for d in defs:
+            if d > c[0]:
+                last = d - 1
+                break
+        ends[c[1]] = last
+    return ends
+
+
+class GattQueue:
+    # timer_id is the machine.Timer used for polling (-1: virtual timer),
+    # None to poll only from the main loop.
+    def __init__(self, ble, conn_handle, timeout_ms=2000, size=16, timer_id=-1):
+        self._ble = ble
+        self._conn_handle = conn_handle
+        self._timeout_ms = timeout_ms
+        self._size = size
+        # [kind, args, callback], oldest first
+        self._pending = []
+        self._current = None
+        self._results = None
+        # ticks_ms of the start of the current procedure and of its last result.
+        self._started = 0
+        self._last = 0
+        self.timeouts = 0
+        # Per connection: characteristic value handle -> CCCD handle found,
+        # and CCCD handle -> value last written to it.
+        self._cccds = {}
+        self._written = {}
+        self._timer = None
+        self._timer_on = False
+        if timer_id is not None and machine is not None and hasattr(machine, "Timer"):
+            try:
+                self._timer = machine.Timer(timer_id)
+            except (ValueError, TypeError, OSError):
+                # No such timer on this port.
+                pass
+        # Bound once: the timer callback must not allocate.
+        self._poll_cb = self._scheduled_poll
+        self._tick_cb = self._tick
+
+    def __len__(self):
+        return len(self._pending) + (self._current is not None)
+
+    def idle(self):
+        return self._current is None and not self._pending
+
+    # A procedure without a callback that fails to start right away raises
+    # the stack's OSError here, as the gattc_* call itself would.
+    def _add(self, kind, args, callback):
+        self.poll()
+        if len(self._pending) >= self._size:
+            raise OSError("GATT queue full")
+        op = [kind, args, callback]
+        self._pending.append(op)
+        if self._current is None:
+            self._next()
+        if len(op) > 3:
+            raise op[3]
+
+    def discover_services(self, callback, uuid=None):
+        self._add(_DISCOVER_SERVICES, (uuid,), callback)
+
+    def discover_characteristics(self, start_handle, end_handle, callback):
+        self._add(_DISCOVER_CHARACTERISTICS, (start_handle, end_handle), callback)
+
+    def discover_descriptors(self, start_handle, end_handle, callback):
+        self._add(_DISCOVER_DESCRIPTORS, (start_handle, end_handle), callback)
+
+    def read(self, value_handle, callback):
+        self._add(_READ, (value_handle,), callback)
+
+    # Writes without response complete as soon as the stack accepts them.
+    def write(self, value_handle, data, response=False, callback=None):
+        self._add(_WRITE, (value_handle, data, 1 if response else 0), callback)
+
+    # Ask for the MTU set with ble.config(mtu=...). Completes on MTU_EXCHANGED.
+    def exchange_mtu(self, callback=None):
+        self._add(_EXCHANGE_MTU, (), callback)
+
+    # Enable (or with both False, disable) notifications/indications through a CCCD handle.
+    def write_cccd(self, cccd_handle, notify=True, indicate=False, callback=None):
+        value = _INDICATE_ENABLE if indicate else _NOTIFY_ENABLE if notify else _CCCD_DISABLE
+        self._add(_WRITE, (cccd_handle, value, 1), callback)
+
+    # Enable notifications (or indications) of the characteristic whose value
+    # is at value_handle. Its CCCD is looked up once, by a descriptor
+    # discovery from value_handle + 1 up to the next characteristic
+    # declaration or end_handle, unless the caller passes cccd_handle (e.g.
+    # from ble_core.peers.HandleCache). A CCCD that already holds the value
+    # is not written again. callback(status, cccd_handle) runs when done;
+    # status is NO_CCCD when the characteristic cannot notify.
+    def subscribe(self, value_handle, end_handle, callback=None, indicate=False, cccd_handle=None):
+        if cccd_handle is None:
+            cccd_handle = self._cccds.get(value_handle)
+        if cccd_handle is not None:
+            self._cccds[value_handle] = cccd_handle
+            self._write_cccd_once(cccd_handle, indicate, callback)
+            return
+        if value_handle + 1 > end_handle:
+            # Nothing after the value: no room for a CCCD.
+            if callback:
+                callback(NO_CCCD, None)
+            return
+
+        def on_descriptors(status, descriptors):
+            cccd = None
+            for d in descriptors:
+                uid = uuids.uuid_id(d[1])
+                if uid == uuids.CCCD:
+                    cccd = d[0]
+                    break
+                if uid == uuids.CHARACTERISTIC:
+                    break
+            if cccd is None:
+                if callback:
+                    callback(status or NO_CCCD, None)
+                return
+            self._cccds[value_handle] = cccd
+            self._write_cccd_once(cccd, indicate, callback)
+
+        self.discover_descriptors(value_handle + 1, end_handle, on_descriptors)
+
+    # Disable notifications and indications of a characteristic subscribed to
+    # on this connection. Returns False if its CCCD was never looked up.
+    def unsubscribe(self, value_handle, callback=None):
+        cccd_handle = self._cccds.get(value_handle)
+        if cccd_handle is None:
+            return False
+        self._written.pop(cccd_handle, None)
+        self.write_cccd(cccd_handle, False, False, callback)
+        return True
+
+    def _write_cccd_once(self, cccd_handle, indicate, callback):
+        value = _INDICATE_ENABLE if indicate else _NOTIFY_ENABLE
+        if self._written.get(cccd_handle) == value:
+            if callback:
+                callback(0, cccd_handle)
+            return
+
+        def on_write(status, _):
+            if status == 0:
+                self._written[cccd_handle] = value
+            if callback:
+                callback(status, cccd_handle)
+
+        self.write_cccd(cccd_handle, not indicate, indicate, on_write)
+
+    def _start(self, kind, args):
+        c = self._conn_handle
+        if kind == _DISCOVER_SERVICES:
+            if args[0] is None:
+                self._ble.gattc_discover_services(c)
+            else:
+                self._ble.gattc_discover_services(c, args[0])
+        elif kind == _DISCOVER_CHARACTERISTICS:
+            self._ble.gattc_discover_characteristics(c, args[0], args[1])
+        elif kind == _DISCOVER_DESCRIPTORS:
+            self._ble.gattc_discover_descriptors(c, args[0], args[1])
+        elif kind == _READ:
+            self._ble.gattc_read(c, args[0])
+        elif kind == _EXCHANGE_MTU:
+            self._ble.gattc_exchange_mtu(c)
+        else:
+            self._ble.gattc_write(c, args[0], args[1], args[2])
+
+    def _next(self):
+        while self._pending:
+            op = self._pending.pop(0)
+            kind = op[0]
+            self._results = [] if kind < _READ else None
+            try:
+                self._start(kind, op[1])
+            except OSError as e:
+                if op[2] is None:
+                    # Kept for _add() to raise.
+                    op.append(e)
+                self._finish(op, e.args[0] if e.args else TIMEOUT, self._results)
+                if self._current is not None:
+                    # The callback queued a procedure, and it was started.
+                    return
+                continue
+            if kind == _WRITE and not op[1][2]:
+                # Unacknowledged write: no completion event follows.
+                self._finish(op, 0, None)
+                if self._current is not None:
+                    return
+                continue
+            self._current = op
+            self._started = self._last = time.ticks_ms()
+            self._arm()
+            return
+        self._current = None
+        self._disarm()
+
+    def _arm(self):
+        if self._timer is not None and not self._timer_on:
+            self._timer.init(mode=machine.Timer.PERIODIC, period=_POLL_MS, callback=self._tick_cb)
+            self._timer_on = True
+
+    def _disarm(self):
+        if self._timer_on:
+            self._timer.deinit()
+            self._timer_on = False
+
+    # Timer callback, possibly in interrupt context: hand over to the scheduler.
+    def _tick(self, _):
+        try:
+            micropython.schedule(self._poll_cb, None)
+        except RuntimeError:
+            # Schedule queue full; the next tick tries again.
+            pass
+
+    def _scheduled_poll(self, _):
+        self.poll()
+
+    def _finish(self, op, status, value):
+        if op[2]:
+            op[2](status, value)
+
+    def _complete(self, status, value):
+        op = self._current
+        self._current = None
+        self._results = None
+        self._finish(op, status, value)
+        if self._current is None:
+            self._next()
+
+    # Finish the current procedure if it has run for longer than timeout_ms,
+    # or on legacy firmware, a discovery whose results have stopped coming.
+    def poll(self):
+        op = self._current
+        if op is None:
+            return
+        now = time.ticks_ms()
+        if irq.LEGACY and self._results and time.ticks_diff(now, self._last) >= _LEGACY_QUIET_MS:
+            self._complete(0, self._results)
+        elif time.ticks_diff(now, self._started) >= self._timeout_ms:
+            self.timeouts += 1
+            self._complete(TIMEOUT, self._results)
+
+    def irq(self, event, data):
+        self.poll()
+        op = self._current
+        if op is None or data[0] != self._conn_handle:
+            return False
+        kind = op[0]
+        if event == _RESULT_EVENTS[kind]:
+            if kind == _READ:
+                if data[1] != op[1][0]:
+                    return False
+                # Copy out of the IRQ-owned buffer.
+                self._results = bytes(data[2])
+                if irq.LEGACY:
+                    self._complete(0, self._results)
+                return True
+            self._results.append(tuple(data[1:]))
+            self._last = time.ticks_ms()
+            return True
+        if event == _DONE_EVENTS[kind]:
+            if kind == _EXCHANGE_MTU:
+                self._complete(0, data[1])
+                return True
+            if kind >= _READ and data[1] != op[1][0]:
+                return False
+            self._complete(data[-1], self._results)
+            return True
+        return False
+
+    # Drop everything queued, e.g. on disconnect. Callbacks are not called.
+    def clear(self):
+        self._pending = []
+        self._current = None
+        self._results = None
+        self._disarm()
+
+
+# errno values for "controller buffers full, try again later": NimBLE runs
+# out of mbufs (ENOMEM), other stacks report EBUSY or EAGAIN.
+_BUSY_ERRORS = (11, 12, 16)
+
+
+class WriteStream:
+    # Bulk data to one characteristic as writes without response, as fast as
+    # the controller takes them. write() only appends to a bounded backlog;
+    # pump() (also run by write()) sends chunk bytes at a time until the
+    # stack reports its buffers full, and the rest waits for the next pump().
+    # Nothing is dropped: write() returns how much of the data fit in the
+    # backlog. chunk is the ATT payload size, MTU - 3.
+    def __init__(self, ble, conn_handle, value_handle, size=1024, chunk=20):
+        self._ble = ble
+        self._conn_handle = conn_handle
+        self._value_handle = value_handle
+        self._ring = bytearray(size)
+        self._mv = memoryview(self._ring)
+        self._size = size
+        self._head = 0
+        self._tail = 0
+        self.chunk = chunk
+        self.sent = 0
+        # pump() calls that stopped on a full controller.
+        self.stalls = 0
+        self._t_start = None
+        self._t_last = None
+
+    def __len__(self):
+        return (self._head - self._tail) % self._size
+
+    def free(self):
+        return self._size - 1 - len(self)
+
+    # Queue data and start sending it. Returns the number of bytes taken.
+    def write(self, data):
+        n = min(len(data), self.free())
+        h = self._head
+        first = min(n, self._size - h)
+        self._mv[h : h + first] = data[:first]
+        if n > first:
+            self._mv[: n - first] = data[first:n]
+        self._head = (h + n) % self._size
+        if n and self._t_start is None:
+            self._t_start = time.ticks_ms()
+        self.pump()
+        return n
+
+    # Send as much of the backlog as the controller accepts. Returns the
+    # number of bytes sent.
+    def pump(self):
+        sent = 0
+        while self._head != self._tail:
+            t = self._tail
+            # Chunks do not wrap around the end of the ring.
+            end = self._head if self._head > t else self._size
+            n = min(self.chunk, end - t)
+            try:
+                self._ble.gattc_write(self._conn_handle, self._value_handle, self._mv[t : t + n], 0)
+            except OSError as e:
+                if e.args and e.args[0] in _BUSY_ERRORS:
+                    self.stalls += 1
+                    break
+                raise
+            self._tail = (t + n) % self._size
+            sent += n
+        if sent:
+            self.sent += sent
+            self._t_last = time.ticks_ms()
+        return sent
+
+    # Pump until the backlog is empty or timeout_ms passes. Returns True if
+    # everything was sent.
+    def flush(self, timeout_ms=5000):
+        start = time.ticks_ms()
+        while self._head != self._tail:
+            if not self.pump():
+                if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms:
+                    return False
+                time.sleep_ms(1)
+        return True
+
+    # Bytes per second handed to the controller, from the first write() to
+    # the last chunk sent.
+    def rate(self):
+        if self._t_start is None or self._t_last is None:
+            return 0
+        ms = time.ticks_diff(self._t_last, self._t_start)
+        return self.sent * 1000 // ms if ms > 0 else 0
+
+
+# One write without response, retried while the controller's buffers are
+# full. Returns False if they still are after timeout_ms.
+def write_no_response(ble, conn_handle, value_handle, data, timeout_ms=1000):
+    start = time.ticks_ms()
+    while True:
+        try:
+            ble.gattc_write(conn_handle, value_handle, data, 0)
+            return True
+        except OSError as e:
+            if not e.args or e.args[0] not in _BUSY_ERRORS:
+                raise
+        if time.ticks_diff(time.ticks_ms(), start) >= timeout_ms:
+            return False
+        time.sleep_ms(1)
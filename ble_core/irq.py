@@ -0,0 +1,63 @@
+# IRQ event codes passed to the bluetooth.BLE().irq() handler.
+#
+# Firmware older than MicroPython v1.13 (the SPIKE Prime and Robot Inventor
+# hubs) reports events as bit flags and has no *_DONE events. Handlers in
+# ble_core call event() first so they can always compare against the
+# numbered codes below.
+
+import sys
+from micropython import const
+
+IRQ_CENTRAL_CONNECT = const(1)
+IRQ_CENTRAL_DISCONNECT = const(2)
+IRQ_GATTS_WRITE = const(3)
+IRQ_GATTS_READ_REQUEST = const(4)
+IRQ_SCAN_RESULT = const(5)
+IRQ_SCAN_DONE = const(6)
+IRQ_PERIPHERAL_CONNECT = const(7)
+IRQ_PERIPHERAL_DISCONNECT = const(8)
+IRQ_GATTC_SERVICE_RESULT = const(9)
+IRQ_GATTC_SERVICE_DONE = const(10)
+IRQ_GATTC_CHARACTERISTIC_RESULT = const(11)
+IRQ_GATTC_CHARACTERISTIC_DONE = const(12)
+IRQ_GATTC_DESCRIPTOR_RESULT = const(13)
+IRQ_GATTC_DESCRIPTOR_DONE = const(14)
+IRQ_GATTC_READ_RESULT = const(15)
+IRQ_GATTC_READ_DONE = const(16)
+IRQ_GATTC_WRITE_DONE = const(17)
+IRQ_GATTC_NOTIFY = const(18)
+IRQ_GATTC_INDICATE = const(19)
+IRQ_MTU_EXCHANGED = const(21)
+
+ADV_IND = const(0x00)
+ADV_DIRECT_IND = const(0x01)
+ADV_SCAN_IND = const(0x02)
+ADV_NONCONN_IND = const(0x03)
+ADV_SCAN_RSP = const(0x04)
+
+# Bit flag -> numbered event, for legacy firmware.
+_LEGACY_EVENTS = {
+    1 << 0: IRQ_CENTRAL_CONNECT,
+    1 << 1: IRQ_CENTRAL_DISCONNECT,
+    1 << 2: IRQ_GATTS_WRITE,
+    1 << 3: IRQ_GATTS_READ_REQUEST,
+    1 << 4: IRQ_SCAN_RESULT,
+    1 << 5: IRQ_SCAN_DONE,
+    1 << 6: IRQ_PERIPHERAL_CONNECT,
+    1 << 7: IRQ_PERIPHERAL_DISCONNECT,
+    1 << 8: IRQ_GATTC_SERVICE_RESULT,
+    1 << 9: IRQ_GATTC_CHARACTERISTIC_RESULT,
+    1 << 10: IRQ_GATTC_DESCRIPTOR_RESULT,
+    1 << 11: IRQ_GATTC_READ_RESULT,
+    1 << 12: IRQ_GATTC_WRITE_DONE,
+    1 << 13: IRQ_GATTC_NOTIFY,
+    1 << 14: IRQ_GATTC_INDICATE,
+}
+
+LEGACY = sys.implementation.name == "micropython" and sys.implementation.version < (1, 13)
+
+
+def event(code):
+    if LEGACY:
+        return _LEGACY_EVENTS.get(code, 0)
+    return code
@@ -0,0 +1,91 @@
+# LEGO Wireless Protocol 3.0 advertisement decoding.
+#
+# LEGO hubs and remotes advertise manufacturer specific data with company
+# identifier 0x0397 followed by six bytes:
+#   button state, system type and device number, device capabilities,
+#   last network ID, status, option
+# See https://lego.github.io/lego-ble-wireless-protocol-docs/#advertising
+
+from micropython import const
+
+_ADV_TYPE_MANUFACTURER = const(0xFF)
+
+LEGO_COMPANY_ID = const(0x0397)
+
+# System type and device number (second byte of the LEGO block).
+WEDO2_HUB = const(0x00)
+DUPLO_TRAIN = const(0x20)
+BOOST_HUB = const(0x40)
+POWERED_UP_HUB = const(0x41)
+POWERED_UP_REMOTE = const(0x42)
+MARIO = const(0x43)
+TECHNIC_HUB = const(0x80)
+SPIKE_PRIME_HUB = const(0x81)
+SPIKE_ESSENTIAL_HUB = const(0x83)
+
+# Device capability bits.
+CAP_CENTRAL = const(0x01)
+CAP_PERIPHERAL = const(0x02)
+CAP_IO = const(0x04)
+CAP_REMOTE = const(0x08)
+
+# Well-known company identifiers, looked up by integer.
+COMPANY_NAMES = {
+    LEGO_COMPANY_ID: "LEGO System A/S",
+    0x004C: "Apple, Inc.",
+    0x0006: "Microsoft",
+    0x0059: "Nordic Semiconductor ASA",
+}
+
+
+class LegoAdv:
+    __slots__ = ("button", "system_type", "capabilities", "last_network", "status", "option")
+
+    def __init__(self, buf, offset):
+        self.button = buf[offset]
+        self.system_type = buf[offset + 1]
+        self.capabilities = buf[offset + 2]
+        self.last_network = buf[offset + 3]
+        self.status = buf[offset + 4]
+        self.option = buf[offset + 5]
+
+    def __repr__(self):
+        return "LegoAdv(type=0x{:02x}, button={}, caps=0x{:02x}, network={})".format(
+            self.system_type, self.button, self.capabilities, self.last_network
+        )
+
+
+# Returns the company identifier of the first manufacturer data field as an
+# int, or None. Reads the two bytes in place.
+def manufacturer_id(payload):
+    n = len(payload)
+    i = 0
+    while i + 1 < n:
+        length = payload[i]
+        end = i + length + 1
+        if length == 0 or end > n:
+            break
+        if payload[i + 1] == _ADV_TYPE_MANUFACTURER and length >= 3:
+            return payload[i + 2] | payload[i + 3] << 8
+        i = end
+    return None
+
+
+# Returns a LegoAdv if the payload carries a LEGO manufacturer block, else
+# None. Non-LEGO payloads are rejected without allocating.
+def decode_lego(payload):
+    n = len(payload)
+    i = 0
+    while i + 1 < n:
+        length = payload[i]
+        end = i + length + 1
+        if length == 0 or end > n:
+            break
+        if (
+            payload[i + 1] == _ADV_TYPE_MANUFACTURER
+            and length >= 9
+            and payload[i + 2] | payload[i + 3] << 8 == LEGO_COMPANY_ID
+        ):
+            return LegoAdv(payload, i + 4)
+        i = end
+    return None
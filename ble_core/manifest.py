@@ -0,0 +1,5 @@
+# Freeze ble_core into a MicroPython build:
+#   make BOARD=... FROZEN_MANIFEST=/path/to/ble_core/manifest.py
+# or include("/path/to/ble_core/manifest.py") from the board manifest.
+
+package("ble_core", base_path="..")
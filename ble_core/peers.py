@@ -0,0 +1,117 @@
+# Known peers and their GATT handles kept on flash, so a script can
+# reconnect at boot without a scan or a discovery.
+#
+# Peers are grouped by role (a free-form name such as "uart" or "microbit"),
+# most recent first. Each peer is stored as
+#   [addr_type, address as hex, name, handles]
+# where handles is an optional dict of GATT handles the caller wants to keep
+# (e.g. {"rx": 12, "tx": 9}). The file is JSON and is only rewritten when
+# something changes, to spare the flash.
+
+import json
+import ubinascii
+
+
+class PeerStore:
+    def __init__(self, path="peers.json", per_role=4):
+        self._path = path
+        self._per_role = per_role
+        try:
+            with open(path) as f:
+                self._roles = json.load(f)
+        except (OSError, ValueError):
+            self._roles = {}
+
+    def _save(self):
+        try:
+            with open(self._path, "w") as f:
+                json.dump(self._roles, f)
+        except OSError:
+            pass
+
+    # Known peers for a role, most recent first, as (addr_type, addr, name, handles).
+    def peers(self, role):
+        return [
+            (p[0], ubinascii.unhexlify(p[1]), p[2], p[3]) for p in self._roles.get(role, ())
+        ]
+
+    # Most recent peer for a role, or None.
+    def last(self, role):
+        peers = self._roles.get(role)
+        if not peers:
+            return None
+        p = peers[0]
+        return p[0], ubinascii.unhexlify(p[1]), p[2], p[3]
+
+    # Record a successful connection. Moves the peer to the front of its role.
+    def remember(self, role, addr_type, addr, name=None, handles=None):
+        entry = [addr_type, ubinascii.hexlify(bytes(addr)).decode(), name, handles]
+        peers = self._roles.get(role, [])
+        if peers and peers[0] == entry:
+            return
+        peers = [entry] + [p for p in peers if p[1] != entry[1]]
+        self._roles[role] = peers[: self._per_role]
+        self._save()
+
+    # Drop a peer that no longer answers, or the whole role when addr is None.
+    def forget(self, role, addr=None):
+        if role not in self._roles:
+            return
+        if addr is None:
+            del self._roles[role]
+        else:
+            key = ubinascii.hexlify(bytes(addr)).decode()
+            self._roles[role] = [p for p in self._roles[role] if p[1] != key]
+        self._save()
+
+
+# Service set key: the services' raw UUID bytes, sorted, as hex.
+def _services_key(services):
+    return ",".join(sorted(ubinascii.hexlify(bytes(u)).decode() for u in services))
+
+
+class HandleCache:
+    # GATT handles found by discovery, kept on flash per peer address and
+    # service set, so a reconnect can skip discovery. handles is whatever
+    # dict the caller needs (e.g. {"start": 1, "end": 20, "rx": 12, "tx": 9}).
+    # A peer's firmware can change its GATT table, so callers must drop()
+    # the entry and discover again when a cached handle turns out wrong.
+    def __init__(self, path="handles.json", size=8):
+        self._path = path
+        self._size = size
+        try:
+            with open(path) as f:
+                # list of [addr hex, services key, handles], most recent first
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = []
+
+    def _save(self):
+        try:
+            with open(self._path, "w") as f:
+                json.dump(self._entries, f)
+        except OSError:
+            pass
+
+    def get(self, addr, services):
+        a = ubinascii.hexlify(bytes(addr)).decode()
+        s = _services_key(services)
+        for e in self._entries:
+            if e[0] == a and e[1] == s:
+                return e[2]
+        return None
+
+    def put(self, addr, services, handles):
+        entry = [ubinascii.hexlify(bytes(addr)).decode(), _services_key(services), handles]
+        if self._entries and self._entries[0] == entry:
+            return
+        self._entries = ([entry] + [e for e in self._entries if e[:2] != entry[:2]])[: self._size]
+        self._save()
+
+    def drop(self, addr, services):
+        a = ubinascii.hexlify(bytes(addr)).decode()
+        s = _services_key(services)
+        n = len(self._entries)
+        self._entries = [e for e in self._entries if e[0] != a or e[1] != s]
+        if len(self._entries) != n:
+            self._save()
@@ -0,0 +1,432 @@
+# Scanning helpers: a table of every device seen while scanning.
+
+import time
+from array import array
+from micropython import const
+
+from ble_core import irq
+from ble_core.adv import ScanFilter, _eq_at, decode_adv
+
+# Smoothed RSSI is kept in 1/16 dBm; each new sample moves it 1/4 of the way.
+_RSSI_SCALE = const(16)
+_RSSI_SHIFT = const(2)
+
+
+class Device:
+    __slots__ = ("addr_type", "addr", "adv_type", "payload", "adv", "first_seen", "last_seen", "count", "_rssi")
+
+    def __init__(self, addr_type, addr, adv_type, rssi, payload, now):
+        self.addr_type = addr_type
+        self.addr = addr
+        self.adv_type = adv_type
+        self.payload = payload
+        self.adv = decode_adv(payload)
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 1
+        self._rssi = rssi * _RSSI_SCALE
+
+    # Smoothed RSSI in dBm.
+    @property
+    def rssi(self):
+        return self._rssi // _RSSI_SCALE
+
+    def name(self):
+        return self.adv.name_str()
+
+    def age_ms(self, now=None):
+        return time.ticks_diff(time.ticks_ms() if now is None else now, self.last_seen)
+
+    def __repr__(self):
+        return "Device({}, {!r}, rssi={}, count={})".format(
+            ":".join("{:02x}".format(b) for b in self.addr), self.name(), self.rssi, self.count
+        )
+
+
+class ScanTable:
+    # Every scan result goes through update(), normally straight from the
+    # scan IRQ. A device costs one Device record; repeated advertisements only
+    # update its counters, and the payload is decoded again only when it
+    # changes. When the table is full, entries older than max_age_ms go first,
+    # then the least recently seen one.
+    def __init__(self, size=32, max_age_ms=30000):
+        self._size = size
+        self._max_age_ms = max_age_ms
+        # addr -> Device
+        self._devices = {}
+
+    def update(self, addr_type, addr, adv_type, rssi, adv_data):
+        now = time.ticks_ms()
+        key = bytes(addr)
+        d = self._devices.get(key)
+        if d is None:
+            if len(self._devices) >= self._size:
+                self.expire(now)
+                if len(self._devices) >= self._size:
+                    self._evict()
+            d = Device(addr_type, key, adv_type, rssi, bytes(adv_data), now)
+            self._devices[key] = d
+            return d
+        d.last_seen = now
+        d.count += 1
+        d._rssi += (rssi * _RSSI_SCALE - d._rssi) >> _RSSI_SHIFT
+        # The stored payload stays the advertisement; scan responses only count as sightings.
+        if adv_type == irq.ADV_SCAN_RSP:
+            return d
+        n = len(adv_data)
+        if n != len(d.payload) or not _eq_at(adv_data, 0, d.payload, n):
+            d.payload = bytes(adv_data)
+            d.adv = decode_adv(d.payload)
+        d.adv_type = adv_type
+        return d
+
+    # Convenience for a scan IRQ handler: table.scan_result(data).
+    def scan_result(self, data):
+        addr_type, addr, adv_type, rssi, adv_data = data
+        return self.update(addr_type, addr, adv_type, rssi, adv_data)
+
+    def _evict(self):
+        oldest = None
+        for key, d in self._devices.items():
+            if oldest is None or time.ticks_diff(d.last_seen, oldest.last_seen) < 0:
+                oldest = d
+        del self._devices[oldest.addr]
+
+    # Drops devices not seen for max_age_ms. Returns how many were dropped.
+    def expire(self, now=None):
+        if now is None:
+            now = time.ticks_ms()
+        stale = [key for key, d in self._devices.items() if time.ticks_diff(now, d.last_seen) > self._max_age_ms]
+        for key in stale:
+            del self._devices[key]
+        return len(stale)
+
+    def get(self, addr):
+        return self._devices.get(bytes(addr))
+
+    # Up to n fresh devices, strongest smoothed RSSI first. scan_filter is a
+    # ble_core.adv.ScanFilter (or the keyword arguments for one) and runs on
+    # the last payload stored for each device.
+    def best(self, n=1, scan_filter=None, **criteria):
+        if scan_filter is None and criteria:
+            scan_filter = ScanFilter(**criteria)
+        now = time.ticks_ms()
+        found = []
+        for d in self._devices.values():
+            if time.ticks_diff(now, d.last_seen) > self._max_age_ms:
+                continue
+            if scan_filter is not None and not scan_filter.match(d.addr, d.adv_type, d.payload):
+                continue
+            found.append(d)
+        found.sort(key=lambda d: d._rssi, reverse=True)
+        return found[:n]
+
+    def clear(self):
+        self._devices.clear()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def __iter__(self):
+        return iter(self._devices.values())
+
+
+# Scan (interval_us, window_us) levels, from a continuous scan down to about 5% radio time.
+DUTY_LEVELS = ((30000, 30000), (60000, 30000), (150000, 30000), (600000, 30000))
+
+
+class ScanScheduler:
+    # Starts scans at full duty cycle and backs off one level after every
+    # misses_per_level scans that find nothing. known() drops straight to the
+    # lowest level once the wanted devices are found, and reset() returns
+    # to full duty. Call scan_done() from the SCAN_DONE IRQ.
+    # radio_ms estimates the time the receiver was on (scan time * window /
+    # interval), so the savings can be measured.
+    def __init__(self, ble, levels=DUTY_LEVELS, misses_per_level=2):
+        self._ble = ble
+        self._levels = levels
+        self._misses_per_level = misses_per_level
+        self.level = 0
+        self.misses = 0
+        self.scan_ms = 0
+        self.radio_ms = 0
+        self._started = None
+
+    def scan(self, duration_ms, active=False):
+        interval_us, window_us = self._levels[self.level]
+        self._started = time.ticks_ms()
+        if active:
+            self._ble.gap_scan(duration_ms, interval_us, window_us, True)
+        else:
+            self._ble.gap_scan(duration_ms, interval_us, window_us)
+
+    def stop(self):
+        self._ble.gap_scan(None)
+
+    # found: whether the scan that just ended matched anything.
+    def scan_done(self, found=False):
+        if self._started is not None:
+            elapsed = time.ticks_diff(time.ticks_ms(), self._started)
+            interval_us, window_us = self._levels[self.level]
+            self.scan_ms += elapsed
+            self.radio_ms += elapsed * window_us // interval_us
+            self._started = None
+        if found:
+            self.misses = 0
+            return
+        self.misses += 1
+        if self.misses >= self._misses_per_level and self.level < len(self._levels) - 1:
+            self.level += 1
+            self.misses = 0
+
+    def known(self):
+        self.level = len(self._levels) - 1
+        self.misses = 0
+
+    def reset(self):
+        self.level = 0
+        self.misses = 0
+
+    # Fraction of scan time the radio was on, in percent.
+    def duty(self):
+        return self.radio_ms * 100 // self.scan_ms if self.scan_ms else 0
+
+
+_ADV_SIZE = const(31)
+
+
+class ScanMerger:
+    # With active scanning, a device follows its advertisement with a scan
+    # response, and the name or a 128-bit UUID is often only in the response.
+    # merge() keeps the last advertisement and scan response of the `size`
+    # most recent addresses in a preallocated buffer. Either packet comes back
+    # as the joined record (up to 62 bytes) with the advertisement's type, so
+    # filters and decoders see the whole record whichever packet arrived. The
+    # record is a view into a reused buffer, valid until the next call, like
+    # the IRQ data itself.
+    def __init__(self, size=16):
+        self._size = size
+        self._addrs = [None] * size
+        self._types = bytearray(size)
+        # Per slot: advertisement and scan response lengths.
+        self._adv_lens = bytearray(size)
+        self._rsp_lens = bytearray(size)
+        # Per slot: 31 bytes of advertisement, then 31 bytes of scan response.
+        self._buf = bytearray(size * 2 * _ADV_SIZE)
+        self._out = bytearray(2 * _ADV_SIZE)
+        self._mv = memoryview(self._buf)
+        self._out_mv = memoryview(self._out)
+        self._next = 0
+        self.merged = 0
+
+    def _find(self, addr):
+        for i in range(self._size):
+            a = self._addrs[i]
+            if a is not None and _eq_at(addr, 0, a, 6):
+                return i
+        return -1
+
+    # Returns (adv_type, adv_data) to use in place of the scan result.
+    def merge(self, addr, adv_type, adv_data):
+        n = len(adv_data)
+        if n > _ADV_SIZE:
+            n = _ADV_SIZE
+        i = self._find(addr)
+        rsp = adv_type == irq.ADV_SCAN_RSP
+        if i < 0:
+            if rsp:
+                # No advertisement seen yet; the response alone is not worth keeping.
+                return adv_type, adv_data
+            i = self._next
+            self._next = (i + 1) % self._size
+            self._addrs[i] = bytes(addr)
+            self._rsp_lens[i] = 0
+        o = i * 2 * _ADV_SIZE
+        if rsp:
+            self._mv[o + _ADV_SIZE : o + _ADV_SIZE + n] = adv_data[:n]
+            self._rsp_lens[i] = n
+        else:
+            self._mv[o : o + n] = adv_data[:n]
+            self._adv_lens[i] = n
+            self._types[i] = adv_type
+        a = self._adv_lens[i]
+        r = self._rsp_lens[i]
+        if not r:
+            return adv_type, adv_data
+        self._out_mv[:a] = self._mv[o : o + a]
+        self._out_mv[a : a + r] = self._mv[o + _ADV_SIZE : o + _ADV_SIZE + r]
+        self.merged += 1
+        return self._types[i], self._out_mv[: a + r]
+
+    def clear(self):
+        for i in range(self._size):
+            self._addrs[i] = None
+        self._next = 0
+
+
+_DUP_PROBES = const(8)
+
+
+# Payload checksum for DuplicateFilter. Kept to 24 bits so every step stays
+# a small int (h * 33 < 2**30): crc32 and 32-bit FNV results above 2**30 are
+# heap-allocated big ints on MicroPython.
+def _checksum(data):
+    h = 5381
+    for b in data:
+        h = ((h * 33) ^ b) & 0xFFFFFF
+    return h
+
+
+class DuplicateFilter:
+    # First check in a scan IRQ: seen() is True when the same address sent
+    # the same kind of packet with the same payload less than window_ms ago, so the result can be dropped
+    # before any printing, decoding or callbacks. One slot per address and
+    # adv_type in a fixed open-addressing table (address, adv_type, payload
+    # checksum, time) probed
+    # linearly; when the probe run is full, its oldest slot is reused. The
+    # table is preallocated and the checksum and ticks stay small ints, so
+    # nothing is allocated per packet (addresses are compared in place).
+    def __init__(self, size=64, window_ms=1000):
+        # Power of two, so the hash can be masked.
+        n = 8
+        while n < size:
+            n <<= 1
+        self._mask = n - 1
+        self._window_ms = window_ms
+        self._addrs = bytearray(6 * n)
+        self._types = bytearray(n)
+        self._crcs = array("I", bytes(4 * n))
+        self._times = array("i", bytes(4 * n))
+        self._used = bytearray(n)
+        self.dropped = 0
+        self.passed = 0
+
+    def seen(self, addr, adv_type, adv_data):
+        now = time.ticks_ms()
+        h = ((addr[5] | addr[4] << 8) ^ (addr[3] | addr[2] << 8) * 7 ^ (addr[1] | addr[0] << 8) * 13 ^ adv_type) & self._mask
+        free = -1
+        oldest = -1
+        for k in range(_DUP_PROBES):
+            i = (h + k) & self._mask
+            if not self._used[i]:
+                if free < 0:
+                    free = i
+                break
+            if self._types[i] == adv_type and _eq_at(self._addrs, i * 6, addr, 6):
+                crc = _checksum(adv_data)
+                if crc == self._crcs[i] and time.ticks_diff(now, self._times[i]) < self._window_ms:
+                    self.dropped += 1
+                    return True
+                self._crcs[i] = crc
+                self._times[i] = now
+                self.passed += 1
+                return False
+            if oldest < 0 or time.ticks_diff(self._times[oldest], self._times[i]) > 0:
+                oldest = i
+        i = free if free >= 0 else oldest
+        self._used[i] = 1
+        self._addrs[i * 6 : i * 6 + 6] = addr
+        self._types[i] = adv_type
+        self._crcs[i] = _checksum(adv_data)
+        self._times[i] = now
+        self.passed += 1
+        return False
+
+    # Convenience for a scan IRQ handler: if dup.scan_result(data): return
+    def scan_result(self, data):
+        return self.seen(data[1], data[2], data[4])
+
+    def clear(self):
+        for i in range(len(self._used)):
+            self._used[i] = 0
+
+
+class ScanResults:
+    # Scan results as they arrive, for `for r in results:` or, under
+    # uasyncio, `async for r in results:`. Each result is a tuple
+    # (addr_type, addr, adv_type, rssi, adv) with adv a decoded AdvData.
+    # put() is called from the scan IRQ and finish() when the scan is done;
+    # under uasyncio they wake the reader through a ThreadSafeFlag, the one
+    # primitive that may be set from an IRQ.
+    # The queue holds at most `size` results; when the reader falls behind,
+    # the oldest ones are dropped and counted in `dropped`. close() ends the
+    # iteration early and calls `stop` (e.g. to stop the scan).
+    def __init__(self, size=16, stop=None):
+        self._items = [None] * size
+        self._size = size
+        self._head = 0
+        self._count = 0
+        self._done = False
+        self._stop = stop
+        self._event = None
+        self._flag = False
+        self.dropped = 0
+
+    def put(self, item):
+        if self._done:
+            return
+        if self._count == self._size:
+            self._head = (self._head + 1) % self._size
+            self._count -= 1
+            self.dropped += 1
+        self._items[(self._head + self._count) % self._size] = item
+        self._count += 1
+        if self._event:
+            self._event.set()
+
+    def finish(self):
+        self._done = True
+        if self._event:
+            self._event.set()
+
+    def close(self):
+        if not self._done and self._stop:
+            self._stop()
+        self.finish()
+
+    def _pop(self):
+        item = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % self._size
+        self._count -= 1
+        return item
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return self
+
+    # Blocks (sleeping) until a result arrives or the scan ends.
+    def __next__(self):
+        while not self._count:
+            if self._done:
+                raise StopIteration
+            time.sleep_ms(10)
+        return self._pop()
+
+    def __aiter__(self):
+        if self._event is None:
+            try:
+                import uasyncio as asyncio
+            except ImportError:
+                import asyncio
+            try:
+                self._event = asyncio.ThreadSafeFlag()
+                self._flag = True
+            except AttributeError:
+                # uasyncio before v1.15, or CPython for host tests.
+                self._event = asyncio.Event()
+        return self
+
+    async def __anext__(self):
+        while True:
+            # An Event is cleared before checking, so a result put in between
+            # still wakes us; a ThreadSafeFlag clears itself in wait().
+            if not self._flag:
+                self._event.clear()
+            if self._count:
+                return self._pop()
+            if self._done:
+                raise StopAsyncIteration
+            await self._event.wait()
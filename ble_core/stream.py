@@ -0,0 +1,123 @@
+# Scan results streamed over USB serial as compact binary frames.
+#
+# The scan IRQ only copies each result into a ring buffer; pump(), called
+# from the main loop, writes whatever is buffered to the stream in bulk.
+# Nothing is formatted as text on the device. Frame layout:
+#   sync      0xB1
+#   length    uint8   (bytes after this one)
+#   ticks_ms  uint32
+#   addr_type uint8
+#   addr      6 bytes
+#   adv_type  uint8
+#   rssi      int8
+#   payload   advertising data or scan response
+# tools/scan_stream.py decodes frames incrementally on the host and skips
+# anything between frames, such as REPL output.
+
+import struct
+import sys
+import time
+from micropython import const
+
+SYNC = const(0xB1)
+_FIXED_SIZE = const(13)
+# Sync, length, fixed fields and a merged 62 byte payload.
+_MAX_FRAME = const(2 + _FIXED_SIZE + 62)
+
+
+class ScanStream:
+    def __init__(self, stream=None, size=4096):
+        if stream is None:
+            stream = getattr(sys.stdout, "buffer", sys.stdout)
+        self._stream = stream
+        self._ring = bytearray(size)
+        self._mv = memoryview(self._ring)
+        self._size = size
+        # Written by push() (IRQ) and pump() (main loop) respectively.
+        self._head = 0
+        self._tail = 0
+        self._frame = bytearray(_MAX_FRAME)
+        self._frame_mv = memoryview(self._frame)
+        self.count = 0
+        self.dropped = 0
+
+    def _free(self):
+        return (self._tail - self._head - 1) % self._size
+
+    # Buffer one scan result. Drops it when the ring is full.
+    def push(self, addr_type, addr, adv_type, rssi, adv_data):
+        n = len(adv_data)
+        if n > _MAX_FRAME - 2 - _FIXED_SIZE:
+            n = _MAX_FRAME - 2 - _FIXED_SIZE
+        total = 2 + _FIXED_SIZE + n
+        if total > self._free():
+            self.dropped += 1
+            return False
+        f = self._frame
+        struct.pack_into("<BBIB", f, 0, SYNC, _FIXED_SIZE + n, time.ticks_ms() & 0xFFFFFFFF, addr_type)
+        self._frame_mv[7:13] = addr
+        struct.pack_into("<Bb", f, 13, adv_type, rssi)
+        self._frame_mv[15 : 15 + n] = adv_data[:n]
+        h = self._head
+        first = self._size - h
+        if total <= first:
+            self._mv[h : h + total] = self._frame_mv[:total]
+        else:
+            self._mv[h:] = self._frame_mv[:first]
+            self._mv[: total - first] = self._frame_mv[first:total]
+        self._head = (h + total) % self._size
+        self.count += 1
+        return True
+
+    # Convenience for a scan IRQ handler: stream.scan_result(data).
+    def scan_result(self, data):
+        addr_type, addr, adv_type, rssi, adv_data = data
+        return self.push(addr_type, addr, adv_type, rssi, adv_data)
+
+    # Write everything buffered so far. Returns the number of bytes written.
+    def pump(self):
+        head = self._head
+        tail = self._tail
+        if head == tail:
+            return 0
+        if head > tail:
+            self._stream.write(self._mv[tail:head])
+            written = head - tail
+        else:
+            self._stream.write(self._mv[tail:])
+            self._stream.write(self._mv[:head])
+            written = self._size - tail + head
+        self._tail = head
+        return written
+
+
+def sniff(duration_ms=60000, active=False):
+    import bluetooth
+    from ble_core import irq
+
+    ble = bluetooth.BLE()
+    ble.active(True)
+    stream = ScanStream()
+    done = False
+
+    def bt_irq(event, data):
+        nonlocal done
+        event = irq.event(event)
+        if event == irq.IRQ_SCAN_RESULT:
+            stream.scan_result(data)
+        elif event == irq.IRQ_SCAN_DONE:
+            done = True
+
+    ble.irq(bt_irq)
+    if active:
+        ble.gap_scan(duration_ms, 30000, 30000, True)
+    else:
+        ble.gap_scan(duration_ms, 30000, 30000)
+    while not done:
+        stream.pump()
+        time.sleep_ms(20)
+    stream.pump()
+
+
+if __name__ == "__main__":
+    sniff()
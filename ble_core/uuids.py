@@ -0,0 +1,102 @@
+# Interned UUIDs for the services and characteristics used in this repository.
+#
+# Every known UUID has one shared bluetooth.UUID object and a small integer
+# ID. Scan and discovery handlers look an incoming UUID up once with
+# uuid_id() and compare integers, instead of comparing against a chain of
+# UUID constants. Decoders use intern() to return the shared object, which
+# avoids building a new one.
+
+import bluetooth
+from micropython import const
+
+UNKNOWN = const(0)
+NUS_SERVICE = const(1)
+NUS_RX = const(2)
+NUS_TX = const(3)
+HUB2HUB_SERVICE = const(4)
+HUB2HUB_RX = const(5)
+HUB2HUB_TX = const(6)
+MICROBIT_ACC_SERVICE = const(7)
+MICROBIT_ACC_DATA = const(8)
+MICROBIT_ACC_PERIOD = const(9)
+MICROBIT_BUTTON_SERVICE = const(10)
+MICROBIT_BUTTON_A = const(11)
+MICROBIT_BUTTON_B = const(12)
+LEGO_HUB_SERVICE = const(13)
+LEGO_HUB_CHAR = const(14)
+CCCD = const(15)
+ENV_SENSING_SERVICE = const(16)
+TEMPERATURE = const(17)
+CHARACTERISTIC = const(18)
+
+# raw little-endian bytes -> (id, UUID), and UUID -> id
+_by_bytes = {}
+_by_uuid = {}
+_by_id = {}
+_next_id = 64
+
+
+# Add a UUID to the table and return its ID. Registering a UUID twice
+# returns the existing ID, so callers can register whatever they use.
+def register(uuid, uid=None):
+    global _next_id
+    if not isinstance(uuid, bluetooth.UUID):
+        uuid = bluetooth.UUID(uuid)
+    raw = bytes(uuid)
+    entry = _by_bytes.get(raw)
+    if entry is not None:
+        return entry[0]
+    if uid is None:
+        uid = _next_id
+        _next_id += 1
+    _by_bytes[raw] = (uid, uuid)
+    _by_uuid[uuid] = uid
+    _by_id[uid] = uuid
+    return uid
+
+
+# ID of a bluetooth.UUID (e.g. from a discovery IRQ) or raw UUID bytes, UNKNOWN if not registered.
+def uuid_id(uuid):
+    if isinstance(uuid, bluetooth.UUID):
+        return _by_uuid.get(uuid, UNKNOWN)
+    entry = _by_bytes.get(bytes(uuid))
+    return entry[0] if entry is not None else UNKNOWN
+
+
+# Shared UUID object for raw UUID bytes; unknown UUIDs get a new object.
+def intern(raw):
+    raw = bytes(raw)
+    entry = _by_bytes.get(raw)
+    if entry is not None:
+        return entry[1]
+    if len(raw) == 2:
+        return bluetooth.UUID(raw[0] | raw[1] << 8)
+    return bluetooth.UUID(raw)
+
+
+# Shared UUID object for an ID.
+def lookup(uid):
+    return _by_id.get(uid)
+
+
+for _uid, _uuid in (
+    (NUS_SERVICE, "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"),
+    (NUS_RX, "6E400002-B5A3-F393-E0A9-E50E24DCCA9E"),
+    (NUS_TX, "6E400003-B5A3-F393-E0A9-E50E24DCCA9E"),
+    (HUB2HUB_SERVICE, "6ee6d166-6084-11eb-ae93-0242ac130002"),
+    (HUB2HUB_RX, "6ee6d3e6-6084-11eb-ae93-0242ac130002"),
+    (HUB2HUB_TX, "6ee6d4cc-6084-11eb-ae93-0242ac130002"),
+    (MICROBIT_ACC_SERVICE, "E95D0753-251D-470A-A062-FA1922DFA9A8"),
+    (MICROBIT_ACC_DATA, "E95DCA4B-251D-470A-A062-FA1922DFA9A8"),
+    (MICROBIT_ACC_PERIOD, "E95DFB24-251D-470A-A062-FA1922DFA9A8"),
+    (MICROBIT_BUTTON_SERVICE, "E95D9882-251D-470A-A062-FA1922DFA9A8"),
+    (MICROBIT_BUTTON_A, "E95DDA90-251D-470A-A062-FA1922DFA9A8"),
+    (MICROBIT_BUTTON_B, "E95DDA91-251D-470A-A062-FA1922DFA9A8"),
+    (LEGO_HUB_SERVICE, "00001623-1212-EFDE-1623-785FEABCD123"),
+    (LEGO_HUB_CHAR, "00001624-1212-EFDE-1623-785FEABCD123"),
+    (CCCD, 0x2902),
+    (ENV_SENSING_SERVICE, 0x181A),
+    (TEMPERATURE, 0x2A6E),
+    (CHARACTERISTIC, 0x2803),
+):
+    register(_uuid, _uid)
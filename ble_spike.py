@@ -4,6 +4,9 @@ import ubluetooth
 import ubinascii
 import struct
 
+from ble_core.lego import COMPANY_NAMES, POWERED_UP_REMOTE, decode_lego
+from ble_core.scan import DuplicateFilter
+
 """
 LEGO(R) SPIKE PRIME + POWERED UP
 --------------------------------
@@ -67,7 +70,7 @@ class PoweredUPRemote:
         """
         # constants
         self.debug = False
-        self.__POWERED_UP_REMOTE_ID = 66
+        self.__POWERED_UP_REMOTE_ID = POWERED_UP_REMOTE
         self.__color = PoweredUPColors.BLUE
         self.__address = None
 
@@ -173,12 +176,12 @@ class PoweredUPRemote:
         color = self.__create_message([0x08, 0x00, 0x81, 0x34, 0x11, 0x51, 0x00, color_byte])
         self.__handler.write(color)
 
-    def __on_scan(self, addr_type, addr, man_data):
+    def __on_scan(self, addr_type, addr, lego):
         if not self.__address:
-            if addr and man_data[2][1] == self.__POWERED_UP_REMOTE_ID:
+            if addr and lego.system_type == self.__POWERED_UP_REMOTE_ID:
                 self.__handler.connect(addr_type, addr)
         else:
-            if self.__address == addr and man_data[2][1] == self.__POWERED_UP_REMOTE_ID:
+            if self.__address == addr and lego.system_type == self.__POWERED_UP_REMOTE_ID:
                 self.__handler.connect(addr_type, addr)
 
     def __on_connect(self):
@@ -288,6 +291,8 @@ class _PoweredUPHandler:
         self.__ble.active(True)
         self.__ble.irq(handler=self.__irq)
         self.__decoder = _Decoder()
+        # repeated advertisements are dropped before they are decoded
+        self.__dedup = DuplicateFilter(window_ms=1000)
         self.__reset()
         self.debug = False
 
@@ -340,6 +345,7 @@ class _PoweredUPHandler:
         """
         self.__log("start scanning...")
         self.__scan_callback = callback
+        self.__dedup.clear()
         self.__ble.gap_scan(timeout, 30000, 30000)
 
     def scan_stop(self):
@@ -435,17 +441,19 @@ class _PoweredUPHandler:
     def __irq(self, event, data):
         if event == self.__IRQ_SCAN_RESULT:
             addr_type, addr, adv_type, rssi, adv_data = data
-            self.__log("result with uuid:", self.__decoder.decode_services(adv_data))
-            self.__log("raw data:", adv_data)
-            #if self.__LEGO_SERVICE_UUID in self.__decoder.decode_services(adv_data):
+            if self.__dedup.seen(addr, adv_type, adv_data):
+                return
+            # only LEGO devices are of interest, everything else is dropped before any decoding
+            lego = decode_lego(adv_data)
+            if lego is None:
+                return
             self.__addr_type = addr_type
             self.__addr = bytes(addr)
             self.__adv_type = adv_type
-            self.__name = self.__decoder.decode_name(adv_data)
-            self.__services = self.__decoder.decode_services(adv_data)
-            self.__man_data = self.__decoder.decode_manufacturer(adv_data)
-            print(self.__addr_type,self.__addr,self.__name,self.__services,self.__man_data)
-            #self.scan_stop()
+            self.__man_data = lego
+            if self.debug:
+                self.__log("result:", self.__addr, self.__decoder.decode_name(adv_data), lego)
+                self.__log("raw data:", bytes(adv_data))
 
         elif event == self.__IRQ_SCAN_COMPLETE:
             if self.__addr:
@@ -497,26 +505,21 @@ class _Decoder:
         """
         create instance of _Decoder
         """
-        self.__COMPANY_IDENTIFIER_CODES = {"0397": "LEGO System A/S"}
+        pass
 
     def decode_manufacturer(self, payload):
         """
         decode manufacturer information from ble data
 
         :param payload: payload data to decode
-        :returns: nothing
+        :returns: [company identifier as int, company name, company data]
         """
-        man_data = []
         n = self.__decode_field(payload, const(0xFF))
-        if not n:
+        if not n or len(n[0]) < 2:
             return []
-        company_identifier = ubinascii.hexlify(struct.pack('<h', *struct.unpack('>h', n[0])))
-        company_name = self.__COMPANY_IDENTIFIER_CODES.get(company_identifier.decode(), "?")
-        company_data = n[0][2:]
-        man_data.append(company_identifier.decode())
-        man_data.append(company_name)
-        man_data.append(company_data)
-        return man_data
+        company_identifier = n[0][0] | n[0][1] << 8
+        company_name = COMPANY_NAMES.get(company_identifier, "?")
+        return [company_identifier, company_name, n[0][2:]]
 
     def decode_name(self, payload):
         """
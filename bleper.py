@@ -4,7 +4,7 @@ import bluetooth
 import random
 import struct
 import time
-from ble_advertising import advertising_payload
+from ble_advertising import advertising_payloads
 
 from micropython import const
 
@@ -40,7 +40,7 @@ class BLESimplePeripheral:
         ((self._handle_tx, self._handle_rx),) = self._ble.gatts_register_services((_UART_SERVICE,))
         self._connections = set()
         self._write_callback = None
-        self._payload = advertising_payload(name=name, services=[_UART_UUID])
+        self._payload, self._resp_payload = advertising_payloads(name=name, services=[_UART_UUID])
         self._advertise()
 
     def _irq(self, event, data):
@@ -70,7 +70,7 @@ class BLESimplePeripheral:
 
     def _advertise(self, interval_us=500000):
         print("Starting advertising")
-        self._ble.gap_advertise(interval_us, adv_data=self._payload)
+        self._ble.gap_advertise(interval_us, adv_data=self._payload, resp_data=self._resp_payload)
 
     def on_write(self, callback):
         self._write_callback = callback
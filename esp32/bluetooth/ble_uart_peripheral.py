@@ -1,13 +1,15 @@
 # This example demonstrates a peripheral implementing the Nordic UART Service (NUS).
 
 import bluetooth
-from ble_advertising import advertising_payload
+from ble_advertising import advertising_payloads
+from ble_core.fragment import DEFAULT_PAYLOAD, Fragmenter, Reassembler, payload_size
 
 from micropython import const
 
 _IRQ_CENTRAL_CONNECT = const(1)
 _IRQ_CENTRAL_DISCONNECT = const(2)
 _IRQ_GATTS_WRITE = const(3)
+_IRQ_MTU_EXCHANGED = const(21)
 
 _FLAG_WRITE = const(0x0008)
 _FLAG_NOTIFY = const(0x0010)
@@ -31,18 +33,32 @@ _ADV_APPEARANCE_GENERIC_COMPUTER = const(128)
 
 
 class BLEUART:
-    def __init__(self, ble, name="mpy-uart", rxbuf=100):
+    def __init__(self, ble, name="mpy-uart", rxbuf=100, mtu=None):
         self._ble = ble
         self._ble.active(True)
         self._ble.irq(self._irq)
+        if mtu:
+            # Largest MTU accepted when the central asks for an exchange.
+            try:
+                self._ble.config(mtu=mtu)
+                rxbuf = max(rxbuf, payload_size(mtu))
+            except (ValueError, TypeError):
+                # Firmware without MTU configuration.
+                pass
+        self._rxbuf = rxbuf
         ((self._tx_handle, self._rx_handle),) = self._ble.gatts_register_services((_UART_SERVICE,))
         # Increase the size of the rx buffer and enable append mode.
         self._ble.gatts_set_buffer(self._rx_handle, rxbuf, True)
-        self._connections = set()
+        # conn_handle -> negotiated MTU
+        self._connections = {}
+        self._fragmenter = Fragmenter()
+        self._reassembler = None
         self._rx_buffer = bytearray()
         self._handler = None
-        # Optionally add services=[_UART_UUID], but this is likely to make the payload too large.
-        self._payload = advertising_payload(name=name, appearance=_ADV_APPEARANCE_GENERIC_COMPUTER)
+        # Whatever does not fit in the advertising payload (usually the name) spills into the scan response.
+        self._payload, self._resp_payload = advertising_payloads(
+            name=name, services=[_UART_UUID], appearance=_ADV_APPEARANCE_GENERIC_COMPUTER
+        )
         self._advertise()
 
     def irq(self, handler):
@@ -52,19 +68,34 @@ class BLEUART:
         # Track connections so we can send notifications.
         if event == _IRQ_CENTRAL_CONNECT:
             conn_handle, _, _ = data
-            self._connections.add(conn_handle)
+            self._connections[conn_handle] = 23
         elif event == _IRQ_CENTRAL_DISCONNECT:
             conn_handle, _, _ = data
             if conn_handle in self._connections:
-                self._connections.remove(conn_handle)
+                del self._connections[conn_handle]
+            if self._reassembler:
+                self._reassembler.reset()
             # Start advertising again to allow a new connection.
             self._advertise()
         elif event == _IRQ_GATTS_WRITE:
             conn_handle, value_handle = data
             if conn_handle in self._connections and value_handle == self._rx_handle:
+                if self._reassembler:
+                    self._reassembler.feed(self._ble.gatts_read(self._rx_handle))
+                    return
                 self._rx_buffer += self._ble.gatts_read(self._rx_handle)
                 if self._handler:
                     self._handler()
+        elif event == _IRQ_MTU_EXCHANGED:
+            conn_handle, mtu = data
+            if conn_handle in self._connections:
+                self._connections[conn_handle] = mtu
+
+    # Largest notification every connected central takes, MTU - 3.
+    def payload_size(self):
+        if not self._connections:
+            return DEFAULT_PAYLOAD
+        return payload_size(min(self._connections.values()))
 
     def any(self):
         return len(self._rx_buffer)
@@ -80,13 +111,31 @@ class BLEUART:
         for conn_handle in self._connections:
             self._ble.gatts_notify(conn_handle, self._tx_handle, data)
 
+    # Notify a message of any length (up to 64 KB), split into fragments of
+    # payload_size() (see ble_core/fragment.py) for a central that rebuilds them.
+    def send(self, message):
+        if isinstance(message, str):
+            message = message.encode()
+        self._fragmenter.set_payload(self.payload_size())
+        for fragment in self._fragmenter.split(message):
+            for conn_handle in self._connections:
+                self._ble.gatts_notify(conn_handle, self._tx_handle, fragment)
+
+    # Receive fragmented messages written to rx instead of a byte stream:
+    # callback(message) runs once per complete message. Each write must be
+    # read before the next one arrives, so append mode is turned off; a
+    # message that loses a fragment that way is dropped.
+    def on_message(self, callback, max_size=1024):
+        self._reassembler = Reassembler(callback, max_size)
+        self._ble.gatts_set_buffer(self._rx_handle, self._rxbuf, False)
+
     def close(self):
         for conn_handle in self._connections:
             self._ble.gap_disconnect(conn_handle)
         self._connections.clear()
 
     def _advertise(self, interval_us=500000):
-        self._ble.gap_advertise(interval_us, adv_data=self._payload)
+        self._ble.gap_advertise(interval_us, adv_data=self._payload, resp_data=self._resp_payload)
 
 
 def demo():
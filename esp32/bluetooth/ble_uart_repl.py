@@ -61,8 +61,10 @@ class BLEUARTStream(io.IOBase):
         return 0
 
     def _flush(self):
-        data = self._tx_buf[0:100]
-        self._tx_buf = self._tx_buf[100:]
+        # One notification each, as large as the negotiated MTU allows.
+        n = self._uart.payload_size()
+        data = self._tx_buf[0:n]
+        self._tx_buf = self._tx_buf[n:]
         self._uart.write(data)
         if self._tx_buf:
             schedule_in(self._flush, 50)
@@ -76,7 +78,7 @@ class BLEUARTStream(io.IOBase):
 
 def start():
     ble = bluetooth.BLE()
-    uart = BLEUART(ble, name="mpy-repl")
+    uart = BLEUART(ble, name="mpy-repl", mtu=247)
     stream = BLEUARTStream(uart)
 
     os.dupterm(stream)
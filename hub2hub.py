@@ -1,12 +1,16 @@
 import bluetooth
 import random
-import struct
 import time
 import micropython
 import sys
 import gc
 from hub import led, display, Image
 from micropython import const
+from ble_core.adv import ScanFilter, advertising_payload, decode_adv
+from ble_core.scan import DuplicateFilter, ScanScheduler
+from ble_core import irq, uuids
+from ble_core.gattc import GattQueue
+from ble_core.peers import HandleCache
 
 _IRQ_CENTRAL_CONNECT =        const(1<<0)
 _IRQ_CENTRAL_DISCONNECT =    const(1<<1)
@@ -27,21 +31,13 @@ _FLAG_WRITE_NO_RESPONSE =    const(0x0004)
 _FLAG_WRITE =                const(0x0008)
 _FLAG_NOTIFY =                const(0x0010)
 
-_ADV_TYPE_FLAGS = const(0x01)
-_ADV_TYPE_NAME = const(0x09)
-_ADV_TYPE_UUID16_COMPLETE = const(0x3)
-_ADV_TYPE_UUID32_COMPLETE = const(0x5)
-_ADV_TYPE_UUID128_COMPLETE = const(0x7)
-_ADV_TYPE_UUID16_MORE = const(0x2)
-_ADV_TYPE_UUID32_MORE = const(0x4)
-_ADV_TYPE_UUID128_MORE = const(0x6)
-_ADV_TYPE_APPEARANCE = const(0x19)
-
 _UART_SERVICE_UUID = bluetooth.UUID('6ee6d166-6084-11eb-ae93-0242ac130002')
 _UART_RX_CHAR_UUID = bluetooth.UUID('6ee6d3e6-6084-11eb-ae93-0242ac130002')
 _UART_TX_CHAR_UUID = bluetooth.UUID('6ee6d4cc-6084-11eb-ae93-0242ac130002')
 
 _UART_UUID = _UART_SERVICE_UUID
+# Key of the child handles in the handle cache.
+_GATT_KEY = (_UART_SERVICE_UUID, _UART_RX_CHAR_UUID, _UART_TX_CHAR_UUID)
 _UART_TX = (
     _UART_TX_CHAR_UUID,
     _FLAG_READ | _FLAG_NOTIFY,
@@ -87,61 +83,6 @@ _CONNECT_ANIMATION_CP_FS = [_CONNECT_IMG_1+_CONNECT_CHILDREN_FOUND_IMG+_CONNECT_
                         _CONNECT_IMG_2+_CONNECT_CHILDREN_FOUND_IMG+_CONNECT_PARENT_SEARCH_IMG,
                         _CONNECT_IMG_3+_CONNECT_CHILDREN_FOUND_IMG+_CONNECT_PARENT_SEARCH_IMG]
 
-# Generate a payload to be passed to gap_advertise(adv_data=...).
-def advertising_payload(limited_disc=False, br_edr=False, name=None, services=None, appearance=0):
-    payload = bytearray()
-
-    def _append(adv_type, value):
-        nonlocal payload
-        payload += struct.pack('BB', len(value) + 1, adv_type) + value
-
-    _append(
-        _ADV_TYPE_FLAGS,
-        struct.pack('B', (0x01 if limited_disc else 0x02) + (0x18 if br_edr else 0x04)),
-    )
-
-    if name:
-        _append(_ADV_TYPE_NAME, name)
-
-    if services:
-        for uuid in services:
-            b = bytes(uuid)
-            if len(b) == 2:
-                _append(_ADV_TYPE_UUID16_COMPLETE, b)
-            elif len(b) == 4:
-                _append(_ADV_TYPE_UUID32_COMPLETE, b)
-            elif len(b) == 16:
-                _append(_ADV_TYPE_UUID128_COMPLETE, b)
-
-    # See org.bluetooth.characteristic.gap.appearance.xml
-    if appearance:
-        _append(_ADV_TYPE_APPEARANCE, struct.pack('<h', appearance))
-
-    return payload
-
-def decode_field(payload, adv_type):
-    i = 0
-    result = []
-    while i + 1 < len(payload):
-        if payload[i + 1] == adv_type:
-            result.append(payload[i + 2 : i + payload[i] + 1])
-        i += 1 + payload[i]
-    return result
-
-def decode_name(payload):
-    n = decode_field(payload, _ADV_TYPE_NAME)
-    return str(n[0], 'utf-8') if n else ''
-
-def decode_services(payload):
-    services = []
-    for u in decode_field(payload, _ADV_TYPE_UUID16_COMPLETE):
-        services.append(bluetooth.UUID(struct.unpack('<h', u)[0]))
-    for u in decode_field(payload, _ADV_TYPE_UUID32_COMPLETE):
-        services.append(bluetooth.UUID(struct.unpack('<d', u)[0]))
-    for u in decode_field(payload, _ADV_TYPE_UUID128_COMPLETE):
-        services.append(bluetooth.UUID(u))
-    return services
-
 def on_scan(self, addr_type, addr, connecting_device):
     if self._debug:
         print('on scan: ' + str(addr_type) + str(addr))
@@ -155,7 +96,7 @@ def on_scan(self, addr_type, addr, connecting_device):
             print('No child found.')
 
 class BLEnetwork:
-    def __init__(self, name, network, state=[], debug = False):
+    def __init__(self, name, network, state=[], debug = False, handle_cache=None):
         if debug:
             print('init')
         self._ble = bluetooth.BLE()
@@ -168,9 +109,18 @@ class BLEnetwork:
         self._address = network[name]
         self._set_local_network()
         self.state = state
+        # Only connectable hubs with the hub2hub service and the name of one of our children.
+        self._scan_filter = ScanFilter(services=[_UART_SERVICE_UUID], names=self._children, connectable=True)
     
         self._scanning = False
         self._connecting_device = None
+        # Full duty cycle first, backing off while children stay out of reach.
+        self._scan_scheduler = ScanScheduler(self._ble)
+        # Drops repeated advertisements before the debug print and the filter.
+        self._dedup = DuplicateFilter(window_ms=1000)
+        # rx and tx handles of the children, kept on flash so a reconnect
+        # skips discovery; see ble_core.peers.HandleCache.
+        self._handle_cache = handle_cache or HandleCache()
 
         ## Connection to Parent
         ((self._handle_tx, self._handle_rx),) = self._ble.gatts_register_services((_UART_SERVICE,))
@@ -206,14 +156,22 @@ class BLEnetwork:
 
         # Connected device.
         self._conn_handle = [None] * self._nr_children
-        self._tx_handle = 9
-        self._rx_handle = 12
+        # Per child: address, GATT queue of the connection, and its (rx, tx)
+        # value handles once discovered or taken from the handle cache.
+        self._child_addr = [None] * self._nr_children
+        self._gattq = [None] * self._nr_children
+        self._handles = [None] * self._nr_children
         
         if self._debug:
             print(self._name+'reset_complete')
         
 
     def _irq(self, event, data):
+        ### Discovery on a child connection
+        for q in self._gattq:
+            if q is not None and q.irq(irq.event(event), data):
+                return
+
         ### Parent connect
         if event == _IRQ_CENTRAL_CONNECT:
             conn_handle, _, _ = data
@@ -245,14 +203,17 @@ class BLEnetwork:
         
         ### Parent scan found BLE device
         elif event == _IRQ_SCAN_RESULT:
+            if self._dedup.scan_result(data):
+                return
             if self._debug:
                 print(self._name+' event: scan result')
             addr_type, addr, adv_type, rssi, adv_data = data
-            if adv_type in (_ADV_IND, _ADV_DIRECT_IND) and _UART_SERVICE_UUID in decode_services(adv_data) and (self._children is None or decode_name(adv_data) in self._children):
+            if self._children and self._scan_filter.match(addr, adv_type, adv_data):
+                name = decode_adv(adv_data).name_str()
                 # Found a potential device, remember it and stop scanning.
                 if self._debug:
-                    print('Child:', decode_name(adv_data), 'Recognized')
-                self._connecting_device = decode_name(adv_data)
+                    print('Child:', name, 'Recognized')
+                self._connecting_device = name
                 self._addr_type = addr_type
                 self._addr = bytes(
                     addr
@@ -264,6 +225,7 @@ class BLEnetwork:
         elif event == _IRQ_SCAN_DONE:
             if self._debug:
                 print(self._name+' event: scan done')
+            self._scan_scheduler.scan_done(self._addr is not None)
             if self._scan_callback:
                 if self._addr:
                     # Found a device during the scan (and the scan was explicitly stopped).
@@ -280,12 +242,19 @@ class BLEnetwork:
                 print(self._name+' event: peripheral connect')
                 
             conn_handle, addr_type, addr = data
-            if addr_type == self._addr_type and addr == self._addr:            
-                self._conn_handle[self._chld_idx[self._connecting_device]]=conn_handle
-                
-                print('Child ' + self._children[self._conn_handle.index(conn_handle)] + ' successfully connected')
-                self._scanning = False
-                self._update_animation()
+            if addr_type == self._addr_type and addr == self._addr:
+                idx = self._chld_idx[self._connecting_device]
+                self._conn_handle[idx]=conn_handle
+                self._child_addr[idx] = self._addr
+                self._gattq[idx] = GattQueue(self._ble, conn_handle)
+                cached = self._handle_cache.get(self._addr, _GATT_KEY)
+                if cached:
+                    self._handles[idx] = (cached["rx"], cached["tx"])
+                    self._child_ready(idx)
+                    # Checked in the background; a changed table is discovered again.
+                    self._discover_characteristics(idx, cached["start"], cached["end"])
+                else:
+                    self._discover(idx)
 
         ### A child disconnected from Parent
         elif event == _IRQ_PERIPHERAL_DISCONNECT:
@@ -296,7 +265,13 @@ class BLEnetwork:
             if conn_handle in self._conn_handle:
                 # If it was initiated by us, it'll already be reset.
                 #self._reset()
-                self._conn_handle[self._conn_handle.index(conn_handle)] = None
+                idx = self._conn_handle.index(conn_handle)
+                self._conn_handle[idx] = None
+                self._gattq[idx].clear()
+                self._gattq[idx] = None
+                self._handles[idx] = None
+                # Lost before discovery finished: connect() scans again.
+                self._scanning = False
                 self._update_animation()
         
         ### A write from Parent to Child is completed
@@ -315,7 +290,7 @@ class BLEnetwork:
             if self._debug:
                 print(notify_data)
             if not self._parent:
-                if conn_handle in self._conn_handle and value_handle == self._tx_handle:
+                if conn_handle in self._conn_handle and value_handle == self._child_tx(conn_handle):
                     if self._notify_callback:
                         self._notify_callback(notify_data.decode())
             else:
@@ -324,6 +299,72 @@ class BLEnetwork:
             if self._debug:
                 print('unknown event:' + str(event))
             
+    # Find the hub2hub service of a child, then its rx and tx in the
+    # service's own handle range.
+    def _discover(self, idx):
+        def on_services(status, services):
+            if status == 0:
+                for start_handle, end_handle, uuid in services:
+                    if uuids.uuid_id(uuid) == uuids.HUB2HUB_SERVICE:
+                        self._discover_characteristics(idx, start_handle, end_handle)
+                        return
+            print('Child has no hub2hub service', status)
+            self._ble.gap_disconnect(self._conn_handle[idx])
+
+        self._gattq[idx].discover_services(on_services)
+
+    def _discover_characteristics(self, idx, start_handle, end_handle):
+        def on_characteristics(status, characteristics):
+            rx = tx = None
+            for def_handle, value_handle, properties, uuid in characteristics if status == 0 else ():
+                uid = uuids.uuid_id(uuid)
+                if uid == uuids.HUB2HUB_RX:
+                    rx = value_handle
+                elif uid == uuids.HUB2HUB_TX:
+                    tx = value_handle
+            addr = self._child_addr[idx]
+            if rx is None or tx is None:
+                if self._handles[idx] is not None:
+                    # Cached handles from an old table: discover from scratch.
+                    self._handle_cache.drop(addr, _GATT_KEY)
+                    self._handles[idx] = None
+                    self._discover(idx)
+                else:
+                    print('Child has no hub2hub rx/tx characteristic')
+                    self._ble.gap_disconnect(self._conn_handle[idx])
+                return
+            self._handle_cache.put(addr, _GATT_KEY, {"start": start_handle, "end": end_handle, "rx": rx, "tx": tx})
+            ready = self._handles[idx] is None
+            self._handles[idx] = (rx, tx)
+            if ready:
+                self._child_ready(idx)
+
+        self._gattq[idx].discover_characteristics(start_handle, end_handle, on_characteristics)
+
+    def _child_ready(self, idx):
+        print('Child ' + self._children[idx] + ' successfully connected')
+        self._scanning = False
+        self._update_animation()
+
+    # Write to a child's rx through its GATT queue, behind a handle check
+    # that may still be running; _tx_available is set again once acknowledged.
+    def _write_child(self, idx, data):
+        self._tx_available = False
+        self._gattq[idx].write(self._handles[idx][0], str(data), True, self._on_write_done)
+
+    def _on_write_done(self, status, _):
+        if status != 0:
+            print('Write to child failed', status)
+        self._tx_available = True
+
+    def _child_rx(self, conn_handle):
+        handles = self._handles[self._conn_handle.index(conn_handle)]
+        return handles[0] if handles else None
+
+    def _child_tx(self, conn_handle):
+        handles = self._handles[self._conn_handle.index(conn_handle)]
+        return handles[1] if handles else None
+
     def _set_local_network(self):
         
         self.address = self._network[self._name]
@@ -363,7 +404,7 @@ class BLEnetwork:
         return self._conn_handle_parent or (self._parent is None)
 
     def children_are_connected(self):
-        return self._conn_handle.count(None) is 0
+        return self._handles.count(None) == 0
     # Returns true if we've successfully connected and discovered characteristics.
     def is_connected(self):
         return self.children_are_connected() and self.parent_is_connected()
@@ -380,7 +421,9 @@ class BLEnetwork:
         if not self.children_are_connected():
             print('Connect to children')
         while not self.children_are_connected():
-            self._ble.gap_scan(20000,30000,30000)
+            self._addr = None
+            self._dedup.clear()
+            self._scan_scheduler.scan(20000)
             self._scanning = True
             children_to_connect = self._conn_handle.count(None)
             if self._debug:
@@ -388,8 +431,16 @@ class BLEnetwork:
                 print(self._conn_handle.count(None))
             while self._scanning:
                 time.sleep_ms(200)
+                # Expires lost discoveries, and ends them on firmware without *_DONE events.
+                for q in self._gattq:
+                    if q is not None:
+                        q.poll()
                 if self._not_found:
                     self._scanning = False
+        if self._nr_children:
+            self._scan_scheduler.known()
+            if self._debug:
+                print('scan ms', self._scan_scheduler.scan_ms, 'radio ms', self._scan_scheduler.radio_ms)
                     
         if not self.parent_is_connected():
             if self._debug:
@@ -426,7 +477,7 @@ class BLEnetwork:
 
     # Connect to the specified device (otherwise use cached address from a scan).
     def connect_device(self, addr_type=None, addr=None, callback=None):
-        self._addr_type = addr_type or self._addr_type
+        self._addr_type = addr_type if addr_type is not None else self._addr_type
         self._addr = addr or self._addr
         self._conn_callback = callback
         if self._addr_type is None or self._addr is None:
@@ -461,6 +512,9 @@ class BLEnetwork:
                         if self._debug:
                             print('send via ', self._children[idx])
                         conn_handle = self._conn_handle[idx]
+            if conn_handle and self._child_rx(conn_handle) is None:
+                # Connected, rx and tx not discovered yet.
+                conn_handle = None
             if conn_handle:
                 if self._debug:
                     print('wait for tx to be available')
@@ -473,8 +527,7 @@ class BLEnetwork:
                     print('conn_handle: ', conn_handle)
                     print('data', str(data))
                 try:
-                    self._ble.gattc_write(conn_handle, self._rx_handle, str(data), 1)
-                    self._tx_available = False
+                    self._write_child(self._conn_handle.index(conn_handle), data)
                     if wait_for_response:
                         self._response_received = False
                 except:
@@ -531,7 +584,7 @@ class BLEnetwork:
                     for idx in addressed_child_idx:
                         if self._debug:
                             print('route message to: ' + self._children[idx])
-                        if self._conn_handle[idx]:
+                        if self._handles[idx]:
                             if self._debug:
                                 print('wait for tx to be available')
                                 led(1)
@@ -540,9 +593,8 @@ class BLEnetwork:
                             if self._debug:
                                 print('tx available')
                                 led(0)
-                            self._ble.gattc_write(self._conn_handle[idx], self._rx_handle, str(data), 1)
+                            self._write_child(idx, data)
                             self._response_received = False
-                            self._tx_available = False
                         else:
                             respond_message = {'_err': 'address: ' + data['_t'] + 'not connected'}
                             self.respond_to_client(respond_message)
@@ -4,32 +4,38 @@ import ubluetooth
 import ubinascii
 from micropython import const
 
+from ble_core.scan import ScanTable
+
 MAC_SPIKE=b'\x40\xbd\x32\x42\xeb\x54'
 MAC_MICRO=b'\xFA\x35\x2F\x6C\x13\xf8'
-MAC_MICRO=b'\xFA\x35\x2F\x6C\x13\xf8'
 MAC_M5=b'\x50\x02\x91\x8d\x17\x26'
 #fa352f6c13f8
 _IRQ_SCAN_RESULT = const(5)
 
 _IRQ_SCAN_DONE = const(6)
-mac=None
+# Every device seen, not just the first match.
+devices = ScanTable(size=64)
+done = False
 
 def bt_irq(event, data):
-    global mac
+    global done
     if event == _IRQ_SCAN_RESULT:
         addr_type, addr, adv_type, rssi, adv_data = data
-    # if rssi>-70:
-    #     print('type:{} addr:{} adv_type: {} rssi:{} data:{}'.format(addr_type, ubinascii.hexlify(addr), adv_type,rssi,ubinascii.hexlify(adv_data)))
-	if addr==MAC_M5:
-		mac=addr
-		print('type:{} addr:{} adv_type: {} rssi:{} data:{}'.format(addr_type, ubinascii.hexlify(addr), adv_type,rssi,ubinascii.hexlify(adv_data)))
-	elif event == _IRQ_SCAN_DONE:
-		print("complete")
+        d = devices.update(addr_type, addr, adv_type, rssi, adv_data)
+        if d.count == 1:
+            print('type:{} addr:{} adv_type: {} rssi:{} data:{}'.format(addr_type, ubinascii.hexlify(addr), adv_type,rssi,ubinascii.hexlify(adv_data)))
+    elif event == _IRQ_SCAN_DONE:
+        print("complete")
+        done = True
 
 
 ble = ubluetooth.BLE()
 ble.active(True)
 ble.irq(bt_irq)
-ble.gap_scan(30000,30000,30000)
-while mac is None:
-	time.sleep_ms(100)
+ble.gap_scan(10000,30000,30000)
+while not done and devices.get(MAC_M5) is None:
+    time.sleep_ms(100)
+ble.gap_scan(None)
+print(len(devices), "devices, strongest:")
+for d in devices.best(10):
+    print(d)
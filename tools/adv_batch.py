@@ -0,0 +1,215 @@
+# Host-side batch decoder for captured advertising payloads (CPython + NumPy).
+#
+# Follows the same AD structure rules as ble_core.adv.decode_adv: each
+# structure is <length> <type> <data>, and a zero length or a structure
+# running past the end of the payload ends the walk. Instead of looping
+# over records, the walk runs over structure positions and processes every
+# record at once, so millions of payloads decode in a few array passes.
+#
+#   python tools/adv_batch.py scan.log --service 6E400001-B5A3-F393-E0A9-E50E24DCCA9E
+#   python tools/adv_batch.py scan.blecap   # binary capture, see tools/capture.py
+
+import argparse
+import re
+
+import numpy as np
+
+import capture
+
+# Advertising data plus scan response.
+WIDTH = 62
+
+_ADV_TYPE_FLAGS = 0x01
+_ADV_TYPE_UUID16 = (0x02, 0x03)
+_ADV_TYPE_UUID32 = (0x04, 0x05)
+_ADV_TYPE_UUID128 = (0x06, 0x07)
+_ADV_TYPE_SHORT_NAME = 0x08
+_ADV_TYPE_NAME = 0x09
+_ADV_TYPE_TX_POWER = 0x0A
+_ADV_TYPE_APPEARANCE = 0x19
+_ADV_TYPE_MANUFACTURER = 0xFF
+
+
+# Raw little-endian bytes of a UUID as it appears on air, from "180A" or
+# "6E400001-B5A3-..." notation.
+def uuid_bytes(uuid):
+    h = uuid.replace("-", "")
+    return np.frombuffer(int(h, 16).to_bytes(len(h) // 2, "little"), dtype=np.uint8)
+
+
+# Pack a sequence of payloads into a zero-padded (N, WIDTH) uint8 matrix and a
+# length vector.
+def pack(payloads):
+    buf = np.zeros((len(payloads), WIDTH), dtype=np.uint8)
+    length = np.zeros(len(payloads), dtype=np.int32)
+    for i, p in enumerate(payloads):
+        p = p[:WIDTH]
+        buf[i, : len(p)] = np.frombuffer(p, dtype=np.uint8)
+        length[i] = len(p)
+    return buf, length
+
+
+# Pack 6-byte addresses into uint64 keys so devices can be grouped with np.unique.
+def addr_keys(addrs):
+    a = np.asarray(addrs, dtype=np.uint64)
+    key = np.zeros(len(a), dtype=np.uint64)
+    for i in range(6):
+        key = (key << np.uint64(8)) | a[:, i]
+    return key
+
+
+def _gather(buf, rows, idx):
+    return buf[rows, np.minimum(idx, buf.shape[1] - 1)]
+
+
+# Decode every payload at once. Returns a dict of columns:
+#   flags, appearance, tx_power, company_id  -- int arrays, -1 when absent
+#   name_off, name_len                       -- location of the (short) name
+#   services                                 -- (N, len(services)) bool matrix
+def decode_batch(buf, length, services=()):
+    n = len(length)
+    rows = np.arange(n)
+    targets = [uuid_bytes(u) if isinstance(u, str) else np.asarray(u, dtype=np.uint8) for u in services]
+
+    flags = np.full(n, -1, dtype=np.int16)
+    appearance = np.full(n, -1, dtype=np.int32)
+    tx_power = np.full(n, -128, dtype=np.int16)
+    company_id = np.full(n, -1, dtype=np.int32)
+    name_off = np.zeros(n, dtype=np.int16)
+    name_len = np.zeros(n, dtype=np.int16)
+    has_name = np.zeros(n, dtype=bool)
+    present = np.zeros((n, len(targets)), dtype=bool)
+
+    pos = np.zeros(n, dtype=np.int32)
+    active = pos + 1 < length
+    while active.any():
+        ad_len = _gather(buf, rows, pos).astype(np.int32)
+        ad_type = _gather(buf, rows, pos + 1)
+        end = pos + ad_len + 1
+        active &= (ad_len > 0) & (end <= length)
+        data = pos + 2
+        data_len = ad_len - 1
+
+        m = active & (ad_type == _ADV_TYPE_FLAGS) & (data_len >= 1)
+        flags[m] = _gather(buf, rows, data)[m]
+
+        m = active & (ad_type == _ADV_TYPE_APPEARANCE) & (data_len == 2)
+        appearance[m] = _gather(buf, rows, data)[m] | _gather(buf, rows, data + 1)[m].astype(np.int32) << 8
+
+        m = active & (ad_type == _ADV_TYPE_TX_POWER) & (data_len == 1)
+        tx_power[m] = _gather(buf, rows, data)[m].view(np.int8)
+
+        m = active & (ad_type == _ADV_TYPE_MANUFACTURER) & (data_len >= 2) & (company_id < 0)
+        company_id[m] = _gather(buf, rows, data)[m] | _gather(buf, rows, data + 1)[m].astype(np.int32) << 8
+
+        # A complete name wins over a shortened one, like decode_adv.
+        m = active & ((ad_type == _ADV_TYPE_NAME) | ((ad_type == _ADV_TYPE_SHORT_NAME) & ~has_name))
+        name_off[m] = data[m]
+        name_len[m] = data_len[m]
+        has_name |= m
+
+        for t, target in enumerate(targets):
+            size = len(target)
+            types = {2: _ADV_TYPE_UUID16, 4: _ADV_TYPE_UUID32, 16: _ADV_TYPE_UUID128}[size]
+            m = active & np.isin(ad_type, types)
+            if not m.any():
+                continue
+            for k in range(0, buf.shape[1] // size):
+                slot = m & ((k + 1) * size <= data_len)
+                if not slot.any():
+                    break
+                idx = (data + k * size)[:, None] + np.arange(size)
+                present[:, t] |= slot & (_gather(buf, rows[:, None], idx) == target).all(axis=1)
+
+        pos = np.where(active, end, pos)
+        active &= pos + 1 < length
+
+    return {
+        "flags": flags,
+        "appearance": appearance,
+        "tx_power": tx_power,
+        "company_id": company_id,
+        "name_off": name_off,
+        "name_len": name_len,
+        "services": present,
+    }
+
+
+# Per-device RSSI series: {addr key: (record indices, rssi values)} in capture order.
+def rssi_series(keys, rssi):
+    order = np.argsort(keys, kind="stable")
+    uniq, start = np.unique(keys[order], return_index=True)
+    groups = np.split(order, start[1:])
+    return {int(k): (g, rssi[g]) for k, g in zip(uniq, groups)}
+
+
+# Last non-empty name seen per device: {addr key: str}. Only one string is
+# built per device, not per record.
+def name_table(keys, buf, columns):
+    has = columns["name_len"] > 0
+    idx = np.nonzero(has)[0]
+    if not len(idx):
+        return {}
+    # Last occurrence per key: unique on the reversed index list.
+    rev = idx[::-1]
+    uniq, first = np.unique(keys[rev], return_index=True)
+    names = {}
+    for k, i in zip(uniq, rev[first]):
+        off, ln = columns["name_off"][i], columns["name_len"][i]
+        names[int(k)] = bytes(buf[i, off : off + ln]).decode("utf-8", "replace")
+    return names
+
+
+_LOG_LINE = re.compile(
+    r"type:(\d+) addr:b?'?([0-9a-fA-F]{12})'? adv_type: ?(\d+) rssi:(-?\d+) data:b?'?([0-9a-fA-F]*)'?"
+)
+
+
+# Parse the text printed by the scan IRQs in scan.py / microSPIKE.py:
+#   type:0 addr:b'fa352f6c13f8' adv_type: 0 rssi:-60 data:b'0201...'
+def load_log(path):
+    addrs, adv_types, rssis, payloads = [], [], [], []
+    with open(path) as f:
+        for line in f:
+            m = _LOG_LINE.search(line)
+            if not m:
+                continue
+            addrs.append(bytes.fromhex(m.group(2)))
+            adv_types.append(int(m.group(3)))
+            rssis.append(int(m.group(4)))
+            payloads.append(bytes.fromhex(m.group(5)))
+    addr = np.frombuffer(b"".join(addrs), dtype=np.uint8).reshape(-1, 6)
+    buf, length = pack(payloads)
+    return addr, np.array(adv_types, dtype=np.uint8), np.array(rssis, dtype=np.int8), buf, length
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise a captured scan log per device.")
+    parser.add_argument("log", help="text log or binary capture")
+    parser.add_argument("--service", action="append", default=[], help="service UUID to flag")
+    args = parser.parse_args()
+
+    if capture.is_capture(args.log):
+        addr, adv_type, rssi, buf, length = capture.scan_columns(capture.open_capture(args.log))
+    else:
+        addr, adv_type, rssi, buf, length = load_log(args.log)
+    keys = addr_keys(addr)
+    columns = decode_batch(buf, length, args.service)
+    names = name_table(keys, buf, columns)
+    for key, (idx, series) in rssi_series(keys, rssi).items():
+        flags = columns["services"][idx].any(axis=0)
+        print(
+            "{:012x} {:>20} n={:<6} rssi mean={:6.1f} min={:4d} max={:4d} services={}".format(
+                key,
+                names.get(key, "?"),
+                len(idx),
+                series.mean(),
+                series.min(),
+                series.max(),
+                "".join("1" if f else "0" for f in flags),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# Micro-benchmarks for the advertising codec.
+#
+#   python3 tools/bench_adv.py [filter]      # CPython, stand-in bluetooth module
+#   micropython tools/bench_adv.py [filter]  # MicroPython unix port
+#
+# Each case runs a warm-up and then N iterations over a corpus of realistic
+# payloads. Reports time per call and heap bytes allocated per call: on
+# MicroPython, gc.mem_alloc() with the collector disabled; on CPython, the
+# tracemalloc peak for one call. Cases that raise on a payload are reported
+# instead of timed. Run it before and after a codec change.
+
+import gc
+import sys
+
+_here = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+sys.path.append(_here + "/..")
+# Stand-ins go last so real MicroPython modules win when they exist.
+sys.path.append(_here + "/stubs")
+
+import bluetooth
+
+import ble_spike
+from ble_core import adv
+from ble_core.lego import decode_lego
+
+MICROPYTHON = sys.implementation.name == "micropython"
+
+if MICROPYTHON:
+    import time
+
+    def _now():
+        return time.ticks_us()
+
+    def _elapsed(start):
+        return time.ticks_diff(time.ticks_us(), start) * 1000
+
+else:
+    import time
+    import tracemalloc
+
+    def _now():
+        return time.perf_counter_ns()
+
+    def _elapsed(start):
+        return time.perf_counter_ns() - start
+
+
+_NUS_UUID = bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
+_LEGO_UUID = bluetooth.UUID("00001623-1212-EFDE-1623-785FEABCD123")
+
+# name: (addr, payload)
+CORPUS = {
+    # Nordic UART peripheral, advertising data and scan response merged.
+    "nus": (
+        b"\xd8\xa0\x1d\x40\x71\x3e",
+        b"".join(adv.advertising_payloads(name="mpy-uart", services=[_NUS_UUID], appearance=128)),
+    ),
+    # micro:bit: flags and a long name only.
+    "microbit": (
+        b"\xfa\x35\x2f\x6c\x13\xf8",
+        b"\x02\x01\x06\x16\x09BBC micro:bit [zotuv]",
+    ),
+    # LEGO Powered Up remote: 128-bit service, LWP3 manufacturer block, name.
+    "lego_remote": (
+        b"\x90\x84\x2b\x4e\x2f\x1a",
+        b"\x02\x01\x06\x11\x07"
+        + bytes(_LEGO_UUID)
+        + b"\x09\xff\x97\x03\x00\x42\x02\x00\x00\x00"
+        + b"\x08\x09Handset",
+    ),
+    # 62 bytes: many 16-bit UUIDs, a 32-bit UUID and a long name.
+    "overfull": (
+        b"\x11\x22\x33\x44\x55\x66",
+        b"\x02\x01\x06\x0f\x03\x0a\x18\x0d\x18\x0f\x18\x1a\x18\x0e\x18\x11\x18\x12\x18"
+        + b"\x05\x05\x78\x56\x34\x12"
+        + b"\x1f\x09"
+        + b"an-overfull-advertising-name-xx",
+    ),
+    # Lengths that run past the end and a zero-length terminator.
+    "malformed": (
+        b"\x00\x00\x00\x00\x00\x01",
+        b"\x02\x01\x06\x1e\x09short\x00\x03\x03\x0a",
+    ),
+}
+
+
+def _measure(func, arg, iterations):
+    try:
+        func(arg)
+    except Exception as e:
+        return "raises", type(e).__name__
+    for _ in range(10):
+        func(arg)
+    gc.collect()
+    if MICROPYTHON:
+        gc.disable()
+        before = gc.mem_alloc()
+        func(arg)
+        alloc = gc.mem_alloc() - before
+        gc.enable()
+    else:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func(arg)
+        alloc = tracemalloc.get_traced_memory()[1] - base
+        tracemalloc.stop()
+    start = _now()
+    for _ in range(iterations):
+        func(arg)
+    return _elapsed(start) // iterations, alloc
+
+
+def _cases():
+    decoder = ble_spike._Decoder()
+    cache = adv.AdvCache()
+    nus_filter = adv.ScanFilter(services=[_NUS_UUID], connectable=True)
+    name_filter = adv.ScanFilter(names=["Handset", "BBC micro:bit [zotuv]"])
+
+    def cached_decode(item):
+        return cache.decode(item[0], item[1])
+
+    return (
+        ("decode_field(name)", lambda item: adv.decode_field(item[1], 0x09)),
+        ("decode_name", lambda item: adv.decode_name(item[1])),
+        ("decode_services", lambda item: adv.decode_services(item[1])),
+        ("decode_adv", lambda item: adv.decode_adv(item[1])),
+        ("AdvCache.decode (hit)", cached_decode),
+        ("ScanFilter.match(nus)", lambda item: nus_filter.match(item[0], 0, item[1])),
+        ("ScanFilter.match(names)", lambda item: name_filter.match(item[0], 0, item[1])),
+        ("decode_lego", lambda item: decode_lego(item[1])),
+        ("_Decoder.decode_name", lambda item: decoder.decode_name(item[1])),
+        ("_Decoder.decode_services", lambda item: decoder.decode_services(item[1])),
+        ("_Decoder.decode_manufacturer", lambda item: decoder.decode_manufacturer(item[1])),
+    )
+
+
+def _build_cases():
+    names = ("mpy-uart", "BBC micro:bit [zotuv]", "an-overfull-advertising-name")
+    services = [_NUS_UUID, bluetooth.UUID(0x181A)]
+
+    def payload(i):
+        return adv.advertising_payload(name=names[i].encode(), services=services, appearance=128)
+
+    def payloads_cold(i):
+        adv._payloads.clear()
+        return adv.advertising_payloads(name=names[i], services=services, appearance=128)
+
+    def payloads_cached(i):
+        return adv.advertising_payloads(name=names[i], services=services, appearance=128)
+
+    return (
+        ("advertising_payload", payload),
+        ("advertising_payloads (cold)", payloads_cold),
+        ("advertising_payloads (cached)", payloads_cached),
+    )
+
+
+def main():
+    pattern = sys.argv[1] if len(sys.argv) > 1 else ""
+    iterations = 2000 if MICROPYTHON else 20000
+    print("{} {}".format(sys.implementation.name, sys.version.split()[0]))
+    print("{:<34}{:<13}{:>10}{:>8}".format("case", "payload", "ns/op", "B/op"))
+    for name, func in _cases():
+        if pattern not in name:
+            continue
+        for label, item in CORPUS.items():
+            ns, alloc = _measure(func, item, iterations)
+            print("{:<34}{:<13}{:>10}{:>8}".format(name, label, ns, alloc))
+    for name, func in _build_cases():
+        if pattern not in name:
+            continue
+        for i in range(3):
+            ns, alloc = _measure(func, i, iterations)
+            print("{:<34}{:<13}{:>10}{:>8}".format(name, "name#%d" % i, ns, alloc))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Host-side reader for captures written by ble_core.capture.CaptureWriter.
+#
+# The file is memory-mapped as a NumPy structured array, so opening a
+# multi-gigabyte capture is instant and any record can be read by index.
+#
+#   python tools/capture.py scan.blecap            # summary
+#   python tools/capture.py scan.blecap --tail 20  # last records
+
+import argparse
+
+import numpy as np
+
+MAGIC = b"BLECAP"
+HEADER_SIZE = 8
+RECORD_SIZE = 80
+
+RECORD = np.dtype(
+    [
+        ("ticks_ms", "<u4"),
+        ("event", "u1"),
+        ("addr_type", "u1"),
+        ("addr", "u1", 6),
+        ("rssi", "i1"),
+        ("adv_type", "u1"),
+        ("length", "u1"),
+        ("reserved", "u1"),
+        ("payload", "u1", 64),
+    ]
+)
+assert RECORD.itemsize == RECORD_SIZE
+
+# MicroPython's ticks_ms() wraps at 2**30, not at the 32 bits it is stored in.
+TICKS_PERIOD = 1 << 30
+
+# IRQ event codes, see ble_core/irq.py.
+EVENTS = {
+    1: "central_connect",
+    2: "central_disconnect",
+    3: "gatts_write",
+    5: "scan_result",
+    6: "scan_done",
+    7: "peripheral_connect",
+    8: "peripheral_disconnect",
+    18: "gattc_notify",
+}
+
+
+def is_capture(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# Memory-map a capture. A trailing partial record (capture cut mid-write) is ignored.
+def open_capture(path):
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+        f.seek(0, 2)
+        size = f.tell()
+    if header[: len(MAGIC)] != MAGIC:
+        raise ValueError("not a BLE capture: {}".format(path))
+    if header[7] != RECORD_SIZE:
+        raise ValueError("unsupported record size {}".format(header[7]))
+    count = (size - HEADER_SIZE) // RECORD_SIZE
+    return np.memmap(path, dtype=RECORD, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+# Time stamps in ms from the first record, with ticks_ms wrap-around undone.
+def timestamps(records):
+    t = records["ticks_ms"].astype(np.int64)
+    wraps = np.concatenate(([0], np.cumsum(np.diff(t) < 0)))
+    return t + wraps * TICKS_PERIOD - t[:1]
+
+
+# Scan results as the (addr, adv_type, rssi, buf, length) tuple used by
+# tools/adv_batch.py.
+def scan_columns(records, scan_event=5):
+    r = records[records["event"] == scan_event]
+    return r["addr"], r["adv_type"], r["rssi"], r["payload"], r["length"].astype(np.int32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a binary BLE capture.")
+    parser.add_argument("capture")
+    parser.add_argument("--tail", type=int, default=0, help="print the last N records")
+    args = parser.parse_args()
+
+    records = open_capture(args.capture)
+    t = timestamps(records)
+    print("{} records over {:.1f} s".format(len(records), (t[-1] if len(t) else 0) / 1000))
+    events, counts = np.unique(records["event"], return_counts=True)
+    for e, c in zip(events, counts):
+        print("  {:<22} {}".format(EVENTS.get(int(e), str(e)), c))
+    for i in range(max(0, len(records) - args.tail), len(records)) if args.tail else ():
+        r = records[i]
+        print(
+            "{:10d} {:<22} {} rssi={:4d} {}".format(
+                int(t[i]),
+                EVENTS.get(int(r["event"]), str(r["event"])),
+                bytes(r["addr"]).hex(),
+                int(r["rssi"]),
+                bytes(r["payload"][: r["length"]]).hex(),
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Host test setup: ble_core and the stand-in modules importable under
+# CPython, and a clock fixture in place of MicroPython's ticks functions.
+import os
+import sys
+import time
+
+import pytest
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(_here, ".."))
+# Stand-ins go last so real modules win when they exist.
+sys.path.append(os.path.join(_here, "stubs"))
+
+_TICKS_PERIOD = 1 << 30
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def ticks_ms(self):
+        return self.now
+
+    def ticks_diff(self, a, b):
+        return ((a - b + _TICKS_PERIOD // 2) % _TICKS_PERIOD) - _TICKS_PERIOD // 2
+
+    def sleep_ms(self, ms):
+        self.advance(ms)
+
+    def advance(self, ms):
+        self.now = (self.now + ms) % _TICKS_PERIOD
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(time, "ticks_ms", c.ticks_ms, raising=False)
+    monkeypatch.setattr(time, "ticks_diff", c.ticks_diff, raising=False)
+    monkeypatch.setattr(time, "sleep_ms", c.sleep_ms, raising=False)
+    return c
+
+
+# Records the gattc_* and gap_* calls made on it; fail maps a method name
+# to the OSError errno it raises.
+class FakeBLE:
+    def __init__(self):
+        self.calls = []
+        self.fail = {}
+
+    def __getattr__(self, name):
+        def call(*args):
+            if name in self.fail:
+                raise OSError(self.fail[name])
+            self.calls.append((name,) + tuple(bytes(a) if isinstance(a, memoryview) else a for a in args))
+
+        return call
+
+
+@pytest.fixture
+def ble():
+    return FakeBLE()
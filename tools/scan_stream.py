@@ -0,0 +1,102 @@
+# Host-side reader for scan results streamed by ble_core.stream.ScanStream.
+#
+# Frames are decoded incrementally as bytes arrive, so the reader keeps up
+# with a live serial port. Bytes between frames (REPL output, a frame cut
+# off by a reset) are skipped.
+#
+#   python tools/scan_stream.py /dev/ttyACM0                     # print results
+#   python tools/scan_stream.py /dev/ttyACM0 --capture out.blecap # for tools/capture.py
+
+import argparse
+import struct
+import sys
+
+SYNC = 0xB1
+FIXED_SIZE = 13
+MAX_PAYLOAD = 62
+
+# Layout of ble_core.capture records, so a stream can be analysed like a capture.
+CAPTURE_HEADER = b"BLECAP" + bytes((1, 80))
+_CAPTURE_EVENT_SCAN_RESULT = 5
+
+
+class FrameReader:
+    def __init__(self):
+        self._buf = bytearray()
+        self.frames = 0
+        self.skipped = 0
+
+    # Add received bytes and return the complete frames as
+    # (ticks_ms, addr_type, addr, adv_type, rssi, payload) tuples.
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+        out = []
+        i = 0
+        n = len(buf)
+        while i + 2 <= n:
+            if buf[i] != SYNC or not FIXED_SIZE <= buf[i + 1] <= FIXED_SIZE + MAX_PAYLOAD:
+                i += 1
+                self.skipped += 1
+                continue
+            end = i + 2 + buf[i + 1]
+            if end > n:
+                break
+            ticks, addr_type = struct.unpack_from("<IB", buf, i + 2)
+            adv_type, rssi = struct.unpack_from("<Bb", buf, i + 13)
+            out.append((ticks, addr_type, bytes(buf[i + 7 : i + 13]), adv_type, rssi, bytes(buf[i + 15 : end])))
+            i = end
+        del buf[:i]
+        self.frames += len(out)
+        return out
+
+
+def _open(path):
+    try:
+        import serial
+    except ImportError:
+        return open(path, "rb", buffering=0)
+    if path.startswith("/dev/") or path.upper().startswith("COM"):
+        return serial.Serial(path, 115200, timeout=0.1)
+    return open(path, "rb", buffering=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode streamed scan results.")
+    parser.add_argument("port", help="serial port or a file with a recorded stream")
+    parser.add_argument("--capture", help="also write the results as a binary capture")
+    parser.add_argument("--quiet", action="store_true", help="do not print results")
+    args = parser.parse_args()
+
+    reader = FrameReader()
+    src = _open(args.port)
+    out = None
+    if args.capture:
+        out = open(args.capture, "wb")
+        out.write(CAPTURE_HEADER)
+    try:
+        while True:
+            data = src.read(4096)
+            if not data:
+                if hasattr(src, "in_waiting"):
+                    continue
+                break
+            for ticks, addr_type, addr, adv_type, rssi, payload in reader.feed(data):
+                if out:
+                    p = payload[:64]
+                    out.write(
+                        struct.pack("<IBB6sbBBB", ticks, _CAPTURE_EVENT_SCAN_RESULT, addr_type, addr, rssi, adv_type, len(p), 0)
+                        + p.ljust(64, b"\0")
+                    )
+                if not args.quiet:
+                    print("{:10d} {} {} adv_type:{} rssi:{:4d} {}".format(ticks, addr_type, addr.hex(), adv_type, rssi, payload.hex()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out:
+            out.close()
+    print("{} frames, {} bytes skipped".format(reader.frames, reader.skipped), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Stand-in for MicroPython's bluetooth module: only what the codec needs.
+# UUIDs hold the little-endian bytes used on air, like the real one. They
+# subclass bytes so bytes(uuid) works on both CPython and MicroPython.
+
+import struct
+
+
+def _uuid_bytes(value):
+    if isinstance(value, int):
+        return struct.pack("<H", value) if value <= 0xFFFF else struct.pack("<I", value)
+    if isinstance(value, str):
+        h = value.replace("-", "")
+        return int(h, 16).to_bytes(len(h) // 2, "little")
+    value = bytes(value)
+    if len(value) not in (2, 4, 16):
+        raise ValueError("invalid UUID")
+    return value
+
+
+class UUID(bytes):
+    def __new__(cls, value):
+        return super().__new__(cls, _uuid_bytes(value))
+
+    def __eq__(self, other):
+        return isinstance(other, UUID) and bytes(self) == bytes(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(bytes(self))
+
+    def __repr__(self):
+        return "UUID({})".format(bytes(reversed(bytes(self))).hex())
+
+    __str__ = __repr__
+
+
+class BLE:
+    def __init__(self):
+        raise OSError("no BLE radio on this host")
@@ -0,0 +1,9 @@
+# Stand-in for the MicroPython "micropython" module so ble_core imports under CPython.
+
+
+def const(x):
+    return x
+
+
+def schedule(func, arg):
+    func(arg)
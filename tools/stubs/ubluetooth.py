@@ -0,0 +1 @@
+from bluetooth import *  # noqa: F401,F403
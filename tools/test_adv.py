@@ -0,0 +1,79 @@
+# Run with: python -m pytest tools
+import bluetooth
+import pytest
+
+from ble_core import adv
+
+_NUS = bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
+_ACC = bluetooth.UUID("E95D0753-251D-470A-A062-FA1922DFA9A8")
+_ENV = bluetooth.UUID(0x181A)
+_ADDR = b"\x01\x02\x03\x04\x05\x06"
+
+
+def test_payloads_decode_back():
+    adv_data, resp_data = adv.advertising_payloads(
+        name="mpy-uart", services=[_ENV, _NUS], appearance=128, manufacturer=(0x0397, b"\x01\x02")
+    )
+    assert len(adv_data) <= 31 and len(resp_data) <= 31
+    d = adv.decode_adv(adv_data + resp_data)
+    assert d.name_str() == "mpy-uart"
+    assert set(d.services()) == {_ENV, _NUS}
+    assert d.appearance == 128
+    assert [bytes(m) for m in d.manufacturer] == [b"\x97\x03\x01\x02"]
+
+
+def test_payloads_are_cached_by_value():
+    data = bytearray(b"\x01")
+    first = adv.advertising_payloads(name="m", manufacturer=(0x0397, data))
+    data[0] = 2
+    second = adv.advertising_payloads(name="m", manufacturer=(0x0397, data))
+    assert first != second
+    assert adv.advertising_payloads(name="m", manufacturer=(0x0397, bytearray(b"\x02"))) is second
+
+
+def test_two_128_bit_services_are_spread_over_both_payloads():
+    adv_data, resp_data = adv.advertising_payloads(name="x", services=[_NUS, _ACC])
+    assert adv.decode_adv(adv_data).services() == [_NUS]
+    assert adv.decode_adv(resp_data).services() == [_ACC]
+    with pytest.raises(ValueError):
+        adv.advertising_payloads(services=[_NUS, _ACC, bluetooth.UUID("00001623-1212-EFDE-1623-785FEABCD123")])
+
+
+def test_long_name_is_shortened():
+    adv_data, resp_data = adv.advertising_payloads(name="n" * 40, services=[_NUS])
+    d = adv.decode_adv(adv_data + resp_data)
+    assert d.name_str().startswith("nnnn")
+    assert len(resp_data) <= 31
+
+
+def test_malformed_payload_does_not_raise():
+    d = adv.decode_adv(b"\x05\x09ab")
+    assert d.services() == []
+
+
+def test_scan_filter():
+    adv_data = adv.advertising_payloads(name="mpy-uart", services=[_NUS])[0]
+    assert adv.ScanFilter(services=[_NUS]).match(_ADDR, 0, adv_data)
+    assert not adv.ScanFilter(services=[_ENV]).match(_ADDR, 0, adv_data)
+    assert adv.ScanFilter(names=["mpy-uart"]).match(_ADDR, 0, adv_data)
+    assert not adv.ScanFilter(names=["mpy"]).match(_ADDR, 0, adv_data)
+    assert adv.ScanFilter(addrs=["01:02:03:04:05:06"]).match(_ADDR, 0, adv_data)
+    assert not adv.ScanFilter(addrs=[b"\x00" * 6]).match(_ADDR, 0, adv_data)
+    # ADV_NONCONN_IND
+    assert not adv.ScanFilter(services=[_NUS], connectable=True).match(_ADDR, 3, adv_data)
+
+
+def test_adv_cache_hits_and_evicts():
+    cache = adv.AdvCache(size=2)
+    payload = adv.advertising_payloads(name="a")[0]
+    first = cache.decode(memoryview(bytearray(_ADDR)), memoryview(bytearray(payload)))
+    assert cache.decode(_ADDR, payload) is first
+    changed = cache.decode(_ADDR, adv.advertising_payloads(name="b")[0])
+    assert changed is not first and changed.name_str() == "b"
+    cache.decode(b"\x02" * 6, payload)
+    cache.decode(_ADDR, payload)
+    # The least recently used address goes.
+    cache.decode(b"\x03" * 6, payload)
+    assert cache.stats() == (1, 5, 2)
+    assert cache.decode(_ADDR, payload) is not None
+    assert cache.stats()[0] == 2
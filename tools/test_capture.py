@@ -0,0 +1,10 @@
+# Run with: python -m pytest tools
+import numpy as np
+
+from capture import RECORD, TICKS_PERIOD, timestamps
+
+
+def test_timestamps_cross_ticks_wrap():
+    records = np.zeros(4, dtype=RECORD)
+    records["ticks_ms"] = [TICKS_PERIOD - 10, TICKS_PERIOD - 5, 3, 8]
+    assert list(timestamps(records)) == [0, 5, 13, 18]
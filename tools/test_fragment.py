@@ -0,0 +1,64 @@
+# Run with: python -m pytest tools
+import pytest
+
+from ble_core.fragment import Fragmenter, Reassembler, payload_size
+
+
+def _split(fragmenter, message):
+    # The fragments share one buffer: copy each, as the radio would send it.
+    return [bytes(f) for f in fragmenter.split(message)]
+
+
+@pytest.mark.parametrize("size", [0, 1, 17, 18, 19, 20, 100, 1024])
+def test_round_trip(size):
+    message = bytes(i & 0xFF for i in range(size))
+    fragments = _split(Fragmenter(), message)
+    assert all(len(f) <= 20 for f in fragments)
+    got = []
+    r = Reassembler(got.append)
+    for f in fragments:
+        r.feed(f)
+    assert got == [message]
+    assert r.errors == 0
+
+
+def test_single_fragment_has_both_flags():
+    (f,) = _split(Fragmenter(), b"hi")
+    assert f == b"\xc0\x02\x00hi"
+
+
+def test_payload_follows_mtu():
+    f = Fragmenter()
+    f.set_payload(payload_size(185))
+    fragments = _split(f, bytes(500))
+    assert [len(x) for x in fragments] == [182, 182, 141]
+    with pytest.raises(ValueError):
+        f.set_payload(3)
+
+
+def test_lost_fragment_drops_message():
+    fragments = _split(Fragmenter(), bytes(60))
+    got = []
+    r = Reassembler(got.append)
+    for f in fragments[:1] + fragments[2:]:
+        r.feed(f)
+    assert got == []
+    assert r.errors == 1
+    # The next message is rebuilt as usual.
+    for f in _split(Fragmenter(), b"next"):
+        r.feed(f)
+    assert got == [b"next"]
+
+
+def test_oversized_message_is_dropped():
+    got = []
+    r = Reassembler(got.append, max_size=32)
+    for f in _split(Fragmenter(), bytes(33)):
+        r.feed(f)
+    assert got == []
+    assert r.errors == 1
+
+
+def test_message_too_long():
+    with pytest.raises(ValueError):
+        _split(Fragmenter(), bytes(0x10000))
@@ -0,0 +1,144 @@
+# Run with: python -m pytest tools
+import bluetooth
+import pytest
+
+from ble_core import irq
+from ble_core.gattc import NO_CCCD, TIMEOUT, GattQueue, characteristic_ends
+
+_CONN = 1
+
+
+def _queue(ble, timeout_ms=2000):
+    return GattQueue(ble, _CONN, timeout_ms=timeout_ms, timer_id=None)
+
+
+def test_procedures_run_one_at_a_time_in_order(clock, ble):
+    q = _queue(ble)
+    done = []
+    q.read(5, lambda status, value: done.append(("read", status, value)))
+    q.write(7, b"a", True, lambda status, value: done.append(("write", status)))
+    q.discover_services(lambda status, value: done.append(("services", status, value)))
+    assert ble.calls == [("gattc_read", _CONN, 5)]
+    assert len(q) == 3
+
+    assert q.irq(irq.IRQ_GATTC_READ_RESULT, (_CONN, 5, bytearray(b"xy")))
+    assert q.irq(irq.IRQ_GATTC_READ_DONE, (_CONN, 5, 0))
+    assert ble.calls[-1] == ("gattc_write", _CONN, 7, b"a", 1)
+    assert q.irq(irq.IRQ_GATTC_WRITE_DONE, (_CONN, 7, 0))
+    assert ble.calls[-1] == ("gattc_discover_services", _CONN)
+    uuid = bluetooth.UUID(0x181A)
+    assert q.irq(irq.IRQ_GATTC_SERVICE_RESULT, (_CONN, 1, 9, uuid))
+    assert q.irq(irq.IRQ_GATTC_SERVICE_DONE, (_CONN, 0))
+
+    assert done == [("read", 0, b"xy"), ("write", 0), ("services", 0, [(1, 9, uuid)])]
+    assert q.idle()
+
+
+def test_events_of_other_connections_are_not_consumed(clock, ble):
+    q = _queue(ble)
+    q.read(5, lambda status, value: None)
+    assert not q.irq(irq.IRQ_GATTC_READ_DONE, (_CONN + 1, 5, 0))
+    assert not q.irq(irq.IRQ_GATTC_READ_DONE, (_CONN, 6, 0))
+    assert len(q) == 1
+
+
+def test_callback_queueing_from_unacknowledged_write_starts_one_procedure(clock, ble):
+    q = _queue(ble)
+    done = []
+    q.read(5, lambda status, value: done.append("read 5"))
+    # Its callback runs inside _next() and queues another procedure.
+    q.write(7, b"a", False, lambda status, value: q.read(9, lambda s, v: done.append("read 9")))
+    q.write(8, b"b", True, lambda status, value: done.append("write 8"))
+
+    q.irq(irq.IRQ_GATTC_READ_DONE, (_CONN, 5, 0))
+    assert ble.calls[1:] == [("gattc_write", _CONN, 7, b"a", 0), ("gattc_write", _CONN, 8, b"b", 1)]
+    q.irq(irq.IRQ_GATTC_WRITE_DONE, (_CONN, 8, 0))
+    assert ble.calls[-1] == ("gattc_read", _CONN, 9)
+    q.irq(irq.IRQ_GATTC_READ_DONE, (_CONN, 9, 0))
+    assert done == ["read 5", "write 8", "read 9"]
+    assert q.idle()
+
+
+def test_failed_start_reports_errno_and_goes_on(clock, ble):
+    q = _queue(ble)
+    done = []
+    ble.fail["gattc_read"] = 114
+    q.read(5, lambda status, value: done.append(status))
+    del ble.fail["gattc_read"]
+    q.read(6, lambda status, value: done.append(status))
+    assert done == [114]
+    assert ble.calls == [("gattc_read", _CONN, 6)]
+
+
+def test_refused_write_without_callback_raises(clock, ble):
+    q = _queue(ble)
+    ble.fail["gattc_write"] = 128
+    with pytest.raises(OSError):
+        q.write(7, b"a")
+    del ble.fail["gattc_write"]
+    q.write(7, b"a")
+    assert ble.calls == [("gattc_write", _CONN, 7, b"a", 0)]
+    assert q.idle()
+
+
+def test_lost_completion_times_out(clock, ble):
+    q = _queue(ble, timeout_ms=500)
+    done = []
+    q.read(5, lambda status, value: done.append(status))
+    q.read(6, lambda status, value: done.append(status))
+    clock.advance(499)
+    q.poll()
+    assert done == []
+    clock.advance(1)
+    q.poll()
+    assert done == [TIMEOUT]
+    assert q.timeouts == 1
+    assert ble.calls[-1] == ("gattc_read", _CONN, 6)
+
+
+def test_legacy_discovery_ends_after_quiet_period(clock, ble, monkeypatch):
+    monkeypatch.setattr(irq, "LEGACY", True)
+    q = _queue(ble)
+    done = []
+    q.discover_characteristics(1, 20, lambda status, value: done.append((status, value)))
+    uuid = bluetooth.UUID(0x2A6E)
+    q.irq(irq.IRQ_GATTC_CHARACTERISTIC_RESULT, (_CONN, 2, 3, 0x12, uuid))
+    clock.advance(100)
+    q.poll()
+    assert done == []
+    clock.advance(200)
+    q.poll()
+    assert done == [(0, [(2, 3, 0x12, uuid)])]
+
+
+def test_subscribe_finds_and_writes_cccd_once(clock, ble):
+    q = _queue(ble)
+    done = []
+    q.subscribe(3, 10, lambda status, cccd: done.append((status, cccd)))
+    assert ble.calls == [("gattc_discover_descriptors", _CONN, 4, 10)]
+    q.irq(irq.IRQ_GATTC_DESCRIPTOR_RESULT, (_CONN, 4, bluetooth.UUID(0x2902)))
+    q.irq(irq.IRQ_GATTC_DESCRIPTOR_DONE, (_CONN, 0))
+    assert ble.calls[-1] == ("gattc_write", _CONN, 4, b"\x01\x00", 1)
+    q.irq(irq.IRQ_GATTC_WRITE_DONE, (_CONN, 4, 0))
+    assert done == [(0, 4)]
+
+    n = len(ble.calls)
+    q.subscribe(3, 10, lambda status, cccd: done.append((status, cccd)))
+    assert len(ble.calls) == n
+    assert done[-1] == (0, 4)
+
+    assert q.unsubscribe(3)
+    assert ble.calls[-1] == ("gattc_write", _CONN, 4, b"\x00\x00", 1)
+
+
+def test_subscribe_without_room_for_cccd(clock, ble):
+    q = _queue(ble)
+    done = []
+    q.subscribe(10, 10, lambda status, cccd: done.append((status, cccd)))
+    assert done == [(NO_CCCD, None)]
+    assert ble.calls == []
+
+
+def test_characteristic_ends():
+    chars = [(5, 6, 0, None), (2, 3, 0, None), (8, 9, 0, None)]
+    assert characteristic_ends(chars, 20) == {3: 4, 6: 7, 9: 20}
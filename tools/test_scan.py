@@ -0,0 +1,43 @@
+# Run with: python -m pytest tools
+from ble_core.scan import DuplicateFilter
+
+_ADDR = b"\x01\x02\x03\x04\x05\x06"
+
+
+def test_repeats_are_dropped_within_the_window(clock):
+    dup = DuplicateFilter(window_ms=1000)
+    assert not dup.seen(_ADDR, 0, b"\x02\x01\x06")
+    assert dup.seen(_ADDR, 0, b"\x02\x01\x06")
+    # Another payload, packet type or address passes.
+    assert not dup.seen(_ADDR, 0, b"\x02\x01\x04")
+    assert not dup.seen(_ADDR, 4, b"\x02\x01\x04")
+    assert not dup.seen(b"\x06\x05\x04\x03\x02\x01", 0, b"\x02\x01\x04")
+    clock.advance(1000)
+    assert not dup.seen(_ADDR, 0, b"\x02\x01\x04")
+    assert (dup.passed, dup.dropped) == (5, 1)
+
+
+def test_window_holds_across_ticks_wrap(clock):
+    clock.now = (1 << 30) - 100
+    dup = DuplicateFilter(window_ms=1000)
+    assert not dup.seen(_ADDR, 0, b"x")
+    clock.advance(500)
+    assert dup.seen(_ADDR, 0, b"x")
+
+
+def test_full_table_reuses_oldest_slot(clock):
+    dup = DuplicateFilter(size=8, window_ms=10000)
+    for i in range(20):
+        clock.advance(1)
+        assert not dup.seen(bytes((i, 0, 0, 0, 0, 0)), 0, b"x")
+    # The newest address is still remembered.
+    assert dup.seen(bytes((19, 0, 0, 0, 0, 0)), 0, b"x")
+
+
+def test_scan_result_takes_irq_data(clock):
+    dup = DuplicateFilter()
+    data = (0, _ADDR, 0, -50, b"\x02\x01\x06")
+    assert not dup.scan_result(data)
+    assert dup.scan_result(data)
+    dup.clear()
+    assert not dup.scan_result(data)